@@ -1,7 +1,38 @@
-from priorityqueueset import PriorityQueueSet
-#import logging
+import time
+
+from priorityqueueset import HeapPriorityQueueSet, LazyHeap, INFINITY
+from profiler import profiler
+
+class SearchStats (object):
+    """
+    Counters filled in by AStar.best_path for the most recent search.
+    With trackExplored set, explored also receives every element the
+    search looked at: expanded nodes and all their neighbours,
+    impassable ones included. disconnected is set when the
+    connectivity index turned the search down without searching, so
+    explored does not hold the tiles an edit would have to touch to
+    change its result.
+    """
+
+    def __init__(self, trackExplored = False):
+        self.trackExplored = trackExplored
+        self.reset()
+
+    def reset(self):
+        self.nodesExpanded = 0
+        self.nodesAllocated = 0
+        self.explored = None
+        self.disconnected = False
+
+    def __repr__(self):
+        return 'expanded: %d, allocated: %d' % (self.nodesExpanded, self.nodesAllocated)
+
+# how far each round of an anytime search lowers its epsilon
+EPSILON_STEP = 0.5
 
 class Node (object):
+    __slots__ = ('elem', 'parent', 'totalCost', 'costFromStart')
+
     def __init__(self, elem, parent = None, totalCost = 0, costFromStart = 0):
         self.elem = elem
         self.costFromStart = costFromStart
@@ -18,92 +49,514 @@ class Node (object):
         return repr(self.elem)
 
 class AStar (object):
+    """
+    Searches in one of MODES:
+
+    'astar': exact A*.
+    'weighted': A* with the heuristic scaled by epsilon, whose paths
+        cost at most epsilon times the optimum with an admissible
+        heuristic and usually take far fewer expansions.
+    'anytime': ARA*, a weighted search whose epsilon is lowered toward
+        1 round by round, reusing the work of earlier rounds; see
+        AnytimeSearch.
+    'bidirectional': exact A* from both ends at once, for
+        neighbourhoods that are symmetric.
+    """
+
+    MODES = ('astar', 'weighted', 'anytime', 'bidirectional')
 
-    def __init__(self, adjacenciesFunc, costFunc, heuristicCostFunc, impassablePred):
+    def __init__(self, adjacenciesFunc, costFunc, heuristicCostFunc, impassablePred,
+                 queueFactory = HeapPriorityQueueSet, connectivity = None, epsilon = 1.5):
         self.adjacenciesFunc = adjacenciesFunc
         self.heuristicCostFunc = heuristicCostFunc
         self.costFunc = costFunc
         self.impassablePred = impassablePred
+        self.queueFactory = queueFactory
+        # an optional ConnectivityIndex over the same tiles, used to turn
+        # down unreachable goals without searching
+        self.connectivity = connectivity
+        # suboptimality bound of 'weighted', and where 'anytime' starts
+        self.epsilon = epsilon
 
-    def best_path(self, posA, posB):
-        results = []
-        closedList = []
-        openList = PriorityQueueSet()
+    def best_path(self, posA, posB, stats = None, mode = 'astar', maxMillis = None,
+                  maxNodes = None):
+        """
+        Returns the list of elements from posA to posB inclusive, or []
+        when there is none. In 'anytime' mode the search keeps
+        improving its path for about maxMillis milliseconds and until
+        it has expanded maxNodes nodes in all, whichever comes first
+        (until it is optimal when neither is given), but always runs
+        until it has one. A node budget gives the same path on any
+        machine.
+        """
+        search = self.search(posA, posB, stats, mode)
+        if mode != 'anytime':
+            search.advance()
+            return search.path
 
-        startNode = Node(posA)
-        endNode = Node(posB)
+        if maxMillis is not None:
+            deadline = time.time() + maxMillis / 1000.0
+        while not search.done:
+            if search.path is None or (maxMillis is None and maxNodes is None):
+                # a late path beats none
+                search.advance()
+                continue
+            remainingMillis = remainingNodes = None
+            if maxMillis is not None:
+                remainingMillis = (deadline - time.time()) * 1000
+                if remainingMillis <= 0:
+                    break
+            if maxNodes is not None:
+                remainingNodes = maxNodes - search.expanded
+                if remainingNodes <= 0:
+                    break
+            search.advance(remainingNodes, remainingMillis)
+        return search.path
 
-        # if start node or end node is impassable then this can not
-        # happen
-        if self.impassablePred(posA) or self.impassablePred(posB):
-            return []
+    def search(self, posA, posB, stats = None, mode = 'astar'):
+        """
+        Returns a resumable search for the path from posA to posB.
+        """
+        if mode == 'astar':
+            return AStarSearch(self, posA, posB, stats)
+        if mode == 'weighted':
+            return AStarSearch(self, posA, posB, stats, self.epsilon)
+        if mode == 'anytime':
+            return AnytimeSearch(self, posA, posB, stats, self.epsilon)
+        if mode == 'bidirectional':
+            return BidirectionalSearch(self, posA, posB, stats)
+        raise ValueError('unknown search mode %r' % mode)
+
+def cannotReach(astar, posA, posB, stats):
+    # if start node or end node is impassable then this can not
+    # happen, nor when the connectivity index keeps them apart
+    if astar.impassablePred(posA) or astar.impassablePred(posB):
+        return True
+    connectivity = astar.connectivity
+    if connectivity is not None and not connectivity.connectedAt(posA.x, posA.y, posB.x, posB.y):
+        if stats is not None:
+            stats.disconnected = True
+        return True
+    return False
+
+class Budget (object):
+    """
+    What one advance() may spend. spend() is called before every
+    expansion and allows the first one, then more while fewer than
+    maxNodes were made and maxMillis have not passed.
+    """
+
+    __slots__ = ('maxNodes', 'deadline', 'spent')
+
+    def __init__(self, maxNodes = None, maxMillis = None):
+        self.maxNodes = maxNodes
+        self.deadline = time.time() + maxMillis / 1000.0 if maxMillis is not None else None
+        self.spent = 0
+
+    def spend(self):
+        if self.maxNodes is not None and self.spent >= self.maxNodes:
+            return False
+        if self.deadline is not None and self.spent > 0 and time.time() >= self.deadline:
+            return False
+        self.spent += 1
+        return True
+
+class SlicedSearch (object):
+    """
+    The state of one search, advanced in slices with advance() until
+    done is set, after which path holds the result. This lets a search
+    be spread over several game ticks. Subclasses expand nodes in
+    _advance(budget) for as long as budget.spend() allows.
+    """
 
-        startNode.costFromStart = self.costFunc(posA)
+    def __init__(self, astar, posA, posB, stats):
+        self.astar = astar
+        self.posA = posA
+        self.posB = posB
+        self.stats = stats
+        self.path = None
+        self.done = False
+
+        self.blocked = None
+        if stats is not None:
+            stats.reset()
+            if stats.trackExplored:
+                self.blocked = set([posA, posB])
+                stats.explored = self.blocked
+
+    def advance(self, maxNodes = None, maxMillis = None):
+        """
+        Expands up to maxNodes nodes or for about maxMillis
+        milliseconds, or until the search ends when neither is given.
+        Returns whether the search is done.
+        """
+        if self.done:
+            return True
+        with profiler.scope('astar'):
+            return self._advance(Budget(maxNodes, maxMillis))
+
+class AStarSearch (SlicedSearch):
+    """
+    The state of one A* search.
+    """
+
+    def __init__(self, astar, posA, posB, stats = None, weight = 1):
+        SlicedSearch.__init__(self, astar, posA, posB, stats)
+        self.weight = weight
+
+        self.closedSet = set()
+        self.openList = astar.queueFactory()
+
+        # every node created during this search, keyed by element, so
+        # that a neighbour reached again is updated in place rather
+        # than reallocated
+        self.nodes = {}
+
+        if cannotReach(astar, posA, posB, stats):
+            self._finish(None)
+            return
+
+        startNode = Node(posA)
+        startNode.costFromStart = astar.costFunc(posA)
         startNode.totalCost = startNode.costFromStart
+        self.nodes[posA] = startNode
 
-        reachedEndNode = False
-        pathEndNode = None
+        # add start node to the open list
+        self.openList.add(startNode, (startNode.totalCost, startNode.costFromStart))
 
-        # add start node to the open list        
-        openList.add(startNode, (startNode.totalCost, startNode.costFromStart))
+    def _advance(self, budget):
+        adjacenciesFunc = self.astar.adjacenciesFunc
+        costFunc = self.astar.costFunc
+        heuristicCostFunc = self.astar.heuristicCostFunc
+        impassablePred = self.astar.impassablePred
+        closedSet = self.closedSet
+        openList = self.openList
+        nodes = self.nodes
+        blocked = self.blocked
+        posB = self.posB
+        weight = self.weight
 
         while len(openList) > 0:
-            #logging.debug('------------------------------')
-            #logging.debug('open: %s' % str(openList))
-            #logging.debug('closed: %s' % str(closedList))
+            if not budget.spend():
+                return False
 
             node = openList.pop()
+            elem = node.elem
 
-            # check if rNode is the end point, if so then we are done
-            if node == endNode:
-                reachedEndNode = True
-                pathEndNode = node
-                break
-            
-            closedList.append(node)
+            # check if node is the end point, if so then we are done
+            if elem == posB:
+                self._finish(node)
+                return True
 
-            #logging.debug('node: %s' % str(node))
-            
-            adjacencies = self.adjacenciesFunc(node.elem)
+            closedSet.add(elem)
 
-            for r in adjacencies:
+            for r in adjacenciesFunc(elem):
 
-                # first check if impassable, if so then skip
-                if self.impassablePred(r):
+                # skip anything already closed or impassable
+                if r in closedSet:
                     continue
-                
-                h = self.heuristicCostFunc(r, posB)
-                g = node.costFromStart + self.costFunc(r)
-                f = g + h
-                rNode = Node(r,
-                             parent = node,
-                             totalCost = f,
-                             costFromStart = g)
-                                
-                # check if rNode is already in the closed list and if
-                # so then ignore it
-                if rNode in closedList:
+                if impassablePred(r):
+                    if blocked is not None:
+                        blocked.add(r)
                     continue
 
-                # check if rNode is already in the open list and if so
-                # then if it's G cost is better or the same then skip
-                # to next node
-                if rNode in openList:
-                    olNodeCost = openList.get(rNode)[1]
-                    if olNodeCost <= rNode.costFromStart:
+                g = node.costFromStart + costFunc(r)
+
+                rNode = nodes.get(r)
+                if rNode is None:
+                    rNode = Node(r,
+                                 parent = node,
+                                 totalCost = g + weight * heuristicCostFunc(r, posB),
+                                 costFromStart = g)
+                    nodes[r] = rNode
+                else:
+                    # already on the open list, keep it unless this
+                    # route is strictly cheaper
+                    if rNode.costFromStart <= g:
                         continue
-            
-                # add rNode to the open list
+                    rNode.totalCost += g - rNode.costFromStart
+                    rNode.costFromStart = g
+                    rNode.parent = node
+
                 openList.add(rNode, (rNode.totalCost, rNode.costFromStart))
 
+        self._finish(None)
+        return True
+
+    def _finish(self, pathEndNode):
+        stats = self.stats
+        if stats is not None:
+            stats.nodesExpanded = len(self.closedSet)
+            stats.nodesAllocated = len(self.nodes)
+            if self.blocked is not None:
+                self.blocked.update(self.nodes)
+
         # backtrack and copy results into the results buffer
-        if reachedEndNode:
-            n = pathEndNode
-            while n:
-                results.append(n.elem)
-                n = n.parent
+        results = []
+        n = pathEndNode
+        while n:
+            results.append(n.elem)
+            n = n.parent
 
         # return it in the forward order
         results.reverse()
-        return results
-    
+        self.path = results
+        self.done = True
+
+        # the search state is no longer needed
+        self.closedSet = self.openList = self.nodes = None
+
+class AnytimeSearch (SlicedSearch):
+    """
+    The state of an ARA* search.
+
+    Every round is a weighted A* that stops once its path is within
+    epsilon of the optimum. path holds the latest round's path from
+    the end of the first round on, and bound how far from optimal that
+    path can be. The next round lowers epsilon by EPSILON_STEP and
+    re-expands only the tiles whose cost improved since they were
+    expanded. done is set when a round ends with a bound of 1, making
+    path optimal, or when there is no path, making it [].
+
+    advance also returns at the end of every round, so a caller sees
+    each new path as it comes.
+    """
+
+    def __init__(self, astar, posA, posB, stats = None, epsilon = 2):
+        SlicedSearch.__init__(self, astar, posA, posB, stats)
+        self.epsilon = max(1, epsilon)
+        self.bound = INFINITY
+        self.rounds = 0
+        self.expanded = 0
+
+        self.g = {}
+        self.parents = {}
+        self.closedSet = set()
+        # closed tiles that got cheaper during this round
+        self.incons = set()
+        self.open = LazyHeap()
+
+        if cannotReach(astar, posA, posB, stats):
+            self._finish([])
+            return
+
+        self.g[posA] = astar.costFunc(posA)
+        self.parents[posA] = None
+        self._push(posA)
+
+    def _push(self, elem):
+        g = self.g[elem]
+        self.open.add(elem, (g + self.epsilon * self.astar.heuristicCostFunc(elem, self.posB), g))
+
+    def _advance(self, budget):
+        adjacenciesFunc = self.astar.adjacenciesFunc
+        costFunc = self.astar.costFunc
+        impassablePred = self.astar.impassablePred
+        g = self.g
+        parents = self.parents
+        closedSet = self.closedSet
+        incons = self.incons
+        open = self.open
+        blocked = self.blocked
+        posB = self.posB
+
+        while True:
+            goalCost = g.get(posB, INFINITY)
+            if goalCost <= open.topKey()[0]:
+                if goalCost == INFINITY:
+                    self._finish([])
+                    return True
+                self._endRound()
+                return self.done
+
+            if not budget.spend():
+                return False
+            self.expanded += 1
+
+            elem = open.pop()
+            closedSet.add(elem)
+
+            costFromStart = g[elem]
+            for r in adjacenciesFunc(elem):
+                if impassablePred(r):
+                    if blocked is not None:
+                        blocked.add(r)
+                    continue
+
+                cost = costFromStart + costFunc(r)
+                if cost < g.get(r, INFINITY):
+                    g[r] = cost
+                    parents[r] = elem
+                    if r in closedSet:
+                        incons.add(r)
+                    else:
+                        self._push(r)
+
+    def _endRound(self):
+        path = []
+        elem = self.posB
+        while elem is not None:
+            path.append(elem)
+            elem = self.parents[elem]
+        path.reverse()
+        self.path = path
+        self.rounds += 1
+
+        # nothing left to expand can reach the goal for less than the
+        # cheapest g + h among the open and improved tiles
+        g = self.g
+        heuristicCostFunc = self.astar.heuristicCostFunc
+        waiting = set(self.open)
+        waiting.update(self.incons)
+        goalCost = g[self.posB]
+        lower = min([g[elem] + heuristicCostFunc(elem, self.posB) for elem in waiting] or [goalCost])
+        self.bound = min(self.epsilon, goalCost / float(lower)) if lower > 0 else self.epsilon
+        if self.bound <= 1:
+            self.bound = 1
+            self._finish(path)
+            return
+
+        self._updateStats()
+        self.epsilon = max(1, self.epsilon - EPSILON_STEP)
+        self.closedSet.clear()
+        self.incons.clear()
+        self.open.clear()
+        for elem in waiting:
+            self._push(elem)
+
+    def _updateStats(self):
+        stats = self.stats
+        if stats is not None:
+            stats.nodesExpanded = self.expanded
+            stats.nodesAllocated = len(self.g)
+            if self.blocked is not None:
+                self.blocked.update(self.g)
+
+    def _finish(self, path):
+        self._updateStats()
+        self.path = path
+        self.done = True
+
+        # the search state is no longer needed
+        self.g = self.parents = self.closedSet = self.incons = self.open = None
+
+class BidirectionalSearch (SlicedSearch):
+    """
+    The state of an A* search run from both ends at once. Each step expands the side with fewer
+    open tiles. A tile reached from both sides joins up a candidate
+    path, and the cheapest candidate is final once no open tile on
+    either side promises a cheaper one.
+
+    The backward side counts the cost of the tiles after a tile, so a
+    candidate costs the sum of both sides' costs at the shared tile.
+    Neighbours must be symmetric, and as with AStar the path is only
+    optimal for a consistent heuristic.
+    """
+
+    def __init__(self, astar, posA, posB, stats = None):
+        SlicedSearch.__init__(self, astar, posA, posB, stats)
+
+        # forward and backward state, indexed by side
+        self.g = ({}, {})
+        self.parents = ({}, {})
+        self.closedSets = (set(), set())
+        self.opens = (LazyHeap(), LazyHeap())
+        self.bestCost = INFINITY
+        self.meeting = None
+
+        if cannotReach(astar, posA, posB, stats):
+            self._finish([])
+            return
+        if posA == posB:
+            self._finish([posA])
+            return
+
+        self.g[0][posA] = astar.costFunc(posA)
+        self.parents[0][posA] = None
+        self._push(0, posA)
+        self.g[1][posB] = 0
+        self.parents[1][posB] = None
+        self._push(1, posB)
+
+    def _push(self, side, elem):
+        g = self.g[side][elem]
+        # the backward side estimates the way back to the start, which
+        # also bounds the forward cost of the same tiles
+        target = self.posA if side else self.posB
+        self.opens[side].add(elem, (g + self.astar.heuristicCostFunc(elem, target), g))
+
+    def _advance(self, budget):
+        adjacenciesFunc = self.astar.adjacenciesFunc
+        costFunc = self.astar.costFunc
+        impassablePred = self.astar.impassablePred
+        blocked = self.blocked
+        opens = self.opens
+
+        while True:
+            # an empty side has nothing left to meet the other with
+            if self.bestCost <= max(opens[0].topKey()[0], opens[1].topKey()[0]):
+                self._finish(self._joinPath())
+                return True
+
+            if not budget.spend():
+                return False
+
+            side = 0 if len(opens[0]) <= len(opens[1]) else 1
+            g = self.g[side]
+            otherG = self.g[1 - side]
+            parents = self.parents[side]
+            closedSet = self.closedSets[side]
+
+            elem = opens[side].pop()
+            closedSet.add(elem)
+
+            if side == 0:
+                costFromElem = g[elem]
+            else:
+                # stepping back onto elem's neighbour enters elem
+                costFromElem = g[elem] + costFunc(elem)
+            for r in adjacenciesFunc(elem):
+                if r in closedSet:
+                    continue
+                if impassablePred(r):
+                    if blocked is not None:
+                        blocked.add(r)
+                    continue
+
+                cost = costFromElem + costFunc(r) if side == 0 else costFromElem
+                if cost < g.get(r, INFINITY):
+                    g[r] = cost
+                    parents[r] = elem
+                    self._push(side, r)
+                    if r in otherG and cost + otherG[r] < self.bestCost:
+                        self.bestCost = cost + otherG[r]
+                        self.meeting = r
+
+    def _joinPath(self):
+        if self.meeting is None:
+            return []
+        path = []
+        elem = self.meeting
+        while elem is not None:
+            path.append(elem)
+            elem = self.parents[0][elem]
+        path.reverse()
+        elem = self.parents[1][self.meeting]
+        while elem is not None:
+            path.append(elem)
+            elem = self.parents[1][elem]
+        return path
+
+    def _finish(self, path):
+        stats = self.stats
+        if stats is not None:
+            stats.nodesExpanded = len(self.closedSets[0]) + len(self.closedSets[1])
+            stats.nodesAllocated = len(self.g[0]) + len(self.g[1])
+            if self.blocked is not None:
+                self.blocked.update(self.g[0])
+                self.blocked.update(self.g[1])
+        self.path = path
+        self.done = True
+
+        # the search state is no longer needed
+        self.g = self.parents = self.closedSets = self.opens = None
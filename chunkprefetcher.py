@@ -0,0 +1,101 @@
+import time, threading
+from Queue import Queue
+
+class ChunkPrefetcher (object):
+    """
+    Watches a MapView scroll and builds, on a worker thread, the chunks
+    the view is heading into before the render thread asks for them.
+
+    The scroll velocity is smoothed over view changes and the view
+    rectangle is projected lookahead seconds ahead; every chunk covering
+    the current view, the projected one and a margin of one chunk
+    around them that the store does not hold yet is queued. Hit rate
+    and main thread stall time come from the ChunkStore counters.
+    """
+
+    def __init__(self, store, mapView, lookahead = 0.5, smoothing = 0.3):
+        self.store = store
+        self.mapView = mapView
+        self.lookahead = lookahead
+        self.smoothing = smoothing
+        self.velocity = [0.0, 0.0]
+
+        self._lastOffset = None
+        self._lastTime = None
+        self._queue = Queue()
+        self._pending = set()
+        self._pendingLock = threading.Lock()
+
+        self.requested = 0
+        self.completed = 0
+
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        mapView.addChangeListener(self._mapViewChangeListener)
+        self._mapViewChangeListener(mapView.offsetX, mapView.offsetY)
+
+    def _mapViewChangeListener(self, x, y):
+        now = time.time()
+        if self._lastOffset is not None and now > self._lastTime:
+            dt = now - self._lastTime
+            s = self.smoothing
+            self.velocity[0] += s * ((x - self._lastOffset[0]) / dt - self.velocity[0])
+            self.velocity[1] += s * ((y - self._lastOffset[1]) / dt - self.velocity[1])
+        self._lastOffset = (x, y)
+        self._lastTime = now
+        self._schedule()
+
+    def _schedule(self):
+        view = self.mapView.view
+        aheadX = self.velocity[0] * self.lookahead
+        aheadY = self.velocity[1] * self.lookahead
+        left = min(view.left, view.left + aheadX)
+        right = max(view.right, view.right + aheadX)
+        top = min(view.top, view.top + aheadY)
+        bottom = max(view.bottom, view.bottom + aheadY)
+
+        # pixels to chunks, with a one chunk margin
+        chunkW = self.mapView.imageSize[0] * self.store.chunkSize
+        chunkH = self.mapView.imageSize[1] * self.store.chunkSize
+        minX = int(left // chunkW) - 1
+        maxX = int(right // chunkW) + 1
+        minY = int(top // chunkH) - 1
+        maxY = int(bottom // chunkH) + 1
+
+        # nearest to the current view first
+        centreX = view.centerx / float(chunkW)
+        centreY = view.centery / float(chunkH)
+        wanted = [(cx, cy) for cy in range(minY, maxY + 1) for cx in range(minX, maxX + 1)
+                  if not self.store.hasChunk(cx, cy)]
+        wanted.sort(key = lambda c: (c[0] + 0.5 - centreX) ** 2 + (c[1] + 0.5 - centreY) ** 2)
+
+        for key in wanted:
+            with self._pendingLock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            self.requested += 1
+            self._queue.put(key)
+
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            if key is None:
+                break
+            if not self.store.hasChunk(*key):
+                self.store.insertChunk(self.store.prepareChunk(*key))
+            with self._pendingLock:
+                self._pending.discard(key)
+            self.completed += 1
+
+    def stop(self):
+        self.mapView.removeChangeListener(self._mapViewChangeListener)
+        self._queue.put(None)
+        self._thread.join()
+
+    def __repr__(self):
+        return 'prefetched: %d/%d, hit rate: %.2f, stalls: %d (%.1fms)' % (
+            self.completed, self.requested, self.store.prefetchHitRate(),
+            self.store.misses, self.store.stallTime * 1000)
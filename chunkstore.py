@@ -0,0 +1,298 @@
+import os, time, threading
+from array import array
+from collections import OrderedDict
+
+from profiler import profiler
+
+class Chunk (object):
+    """
+    One square block of tiles stored as typed arrays indexed by
+    y*size+x: type id and image id as unsigned bytes/shorts and cost as
+    a double, so a cost reads back exactly as it was set.
+    """
+    __slots__ = ('cx', 'cy', 'types', 'images', 'costs', 'dirty', 'prefetched', 'version')
+
+    def __init__(self, cx, cy, types, images, costs):
+        self.cx = cx
+        self.cy = cy
+        self.types = types
+        self.images = images
+        self.costs = costs
+        self.dirty = False
+        self.prefetched = False
+        # the store's version of the chunk when it was built
+        self.version = 0
+
+class ChunkStore (object):
+    """
+    Tile storage split into fixed size chunks which are generated on
+    first touch and evicted least recently used first once more than
+    maxBytes are held. With a directory, evicted and flushed chunks are
+    written out as one flat file each and read back instead of being
+    generated again; without one, edited chunks are never evicted so
+    that edits are not lost.
+
+    generator(x0, y0, size) returns three row-major sequences of
+    size*size type names, image names and costs for the chunk whose
+    top left tile is (x0, y0).
+
+    Chunks can also be built off the main thread with prepareChunk and
+    handed over with insertChunk, which turns a chunk down if it was
+    edited or evicted after the build started. misses and stallTime
+    count the chunks getChunk had to build itself and the seconds that
+    took, and prefetchHits the inserted chunks it found waiting.
+    """
+
+    def __init__(self, generator, chunkSize = 32, maxBytes = 64 << 20, directory = None):
+        self.generator = generator
+        self.chunkSize = chunkSize
+        self.directory = directory
+        self.chunkBytes = chunkSize * chunkSize * (1 + 2 + 8)
+        self.maxChunks = max(1, maxBytes // self.chunkBytes)
+
+        self.typeNames = []
+        self.imageNames = []
+        self._typeIds = {}
+        self._imageIds = {}
+
+        self._chunks = OrderedDict()
+        # key -> count of edits and evictions, so a chunk built from an
+        # older state can be recognised
+        self._versions = {}
+        # (key, chunk) of the last lookup, read without taking the lock
+        self._last = (None, None)
+        self._lock = threading.RLock()
+
+        self.generated = 0
+        self.loaded = 0
+        self.saved = 0
+        self.evicted = 0
+        self.misses = 0
+        self.stallTime = 0.0
+        self.prefetched = 0
+        self.prefetchHits = 0
+
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._loadPalette()
+
+    def typeId(self, name):
+        if name not in self._typeIds:
+            with self._lock:
+                if name not in self._typeIds:
+                    self.typeNames.append(name)
+                    self._typeIds[name] = len(self.typeNames) - 1
+        return self._typeIds[name]
+
+    def imageId(self, name):
+        if name not in self._imageIds:
+            with self._lock:
+                if name not in self._imageIds:
+                    self.imageNames.append(name)
+                    self._imageIds[name] = len(self.imageNames) - 1
+        return self._imageIds[name]
+
+    def _palettePath(self):
+        return os.path.join(self.directory, 'palette')
+
+    def _loadPalette(self):
+        # the name behind every type and image id, one kind per line
+        if not os.path.exists(self._palettePath()):
+            return
+        f = open(self._palettePath())
+        lines = f.read().split('\n')
+        f.close()
+        for name in lines[0].split():
+            self.typeId(name)
+        for name in lines[1].split():
+            self.imageId(name)
+
+    def _savePalette(self):
+        f = open(self._palettePath(), 'w')
+        f.write(' '.join(self.typeNames) + '\n' + ' '.join(self.imageNames) + '\n')
+        f.close()
+
+    def _chunkPath(self, cx, cy):
+        return os.path.join(self.directory, 'chunk_%d_%d' % (cx, cy))
+
+    def chunkAt(self, x, y):
+        size = self.chunkSize
+        return self.getChunk(x // size, y // size)
+
+    def getChunk(self, cx, cy):
+        key = (cx, cy)
+        last = self._last
+        if key == last[0]:
+            return last[1]
+
+        with self._lock:
+            chunk = self._chunks.pop(key, None)
+            if chunk is None:
+                start = time.time()
+                chunk = self.prepareChunk(cx, cy)
+                self.stallTime += time.time() - start
+                self.misses += 1
+            elif chunk.prefetched:
+                chunk.prefetched = False
+                self.prefetchHits += 1
+            self._chunks[key] = chunk
+            self._last = (key, chunk)
+
+            if len(self._chunks) > self.maxChunks:
+                self._evict()
+        return chunk
+
+    def hasChunk(self, cx, cy):
+        return (cx, cy) in self._chunks
+
+    def prepareChunk(self, cx, cy):
+        """
+        Loads or generates a chunk without adding it to the store, so
+        it is safe to call from another thread.
+        """
+        version = self._versions.get((cx, cy), 0)
+        chunk = self._load(cx, cy)
+        if chunk is None:
+            chunk = self._generate(cx, cy)
+        chunk.version = version
+        return chunk
+
+    def insertChunk(self, chunk):
+        with self._lock:
+            key = (chunk.cx, chunk.cy)
+            if key in self._chunks or self._versions.get(key, 0) != chunk.version:
+                return False
+            chunk.prefetched = True
+            self._chunks[key] = chunk
+            self.prefetched += 1
+
+            if len(self._chunks) > self.maxChunks:
+                self._evict()
+        return True
+
+    def prefetchHitRate(self):
+        total = self.prefetchHits + self.misses
+        if not total:
+            return 0.0
+        return float(self.prefetchHits) / total
+
+    def _generate(self, cx, cy):
+        size = self.chunkSize
+        with profiler.scope('terrain'):
+            typeNames, imageNames, costs = self.generator(cx * size, cy * size, size)
+        chunk = Chunk(cx, cy,
+                      array('B', [self.typeId(name) for name in typeNames]),
+                      array('H', [self.imageId(name) for name in imageNames]),
+                      array('d', costs))
+        # keep a copy on disk so it is never generated twice
+        chunk.dirty = self.directory is not None
+        self.generated += 1
+        return chunk
+
+    def _load(self, cx, cy):
+        if self.directory is None:
+            return None
+        path = self._chunkPath(cx, cy)
+        if not os.path.exists(path):
+            return None
+
+        tiles = self.chunkSize * self.chunkSize
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        types = array('B')
+        types.fromstring(data[:tiles])
+        images = array('H')
+        images.fromstring(data[tiles:3 * tiles])
+        if len(data) == 7 * tiles:
+            # written when costs were 32 bit floats
+            costs = array('f')
+            costs.fromstring(data[3 * tiles:])
+            costs = array('d', costs)
+        else:
+            costs = array('d')
+            costs.fromstring(data[3 * tiles:11 * tiles])
+
+        self.loaded += 1
+        return Chunk(cx, cy, types, images, costs)
+
+    def _bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _save(self, chunk):
+        # written aside and renamed into place, so a reader on another
+        # thread sees the old file or the new one and never half of one
+        path = self._chunkPath(chunk.cx, chunk.cy)
+        f = open(path + '.tmp', 'wb')
+        f.write(chunk.types.tostring())
+        f.write(chunk.images.tostring())
+        f.write(chunk.costs.tostring())
+        f.close()
+        try:
+            os.rename(path + '.tmp', path)
+        except OSError:
+            # Windows will not rename over an existing file
+            os.remove(path)
+            os.rename(path + '.tmp', path)
+        chunk.dirty = False
+        self.saved += 1
+        self._savePalette()
+
+    def _evict(self):
+        for key in list(self._chunks.keys()):
+            if len(self._chunks) <= self.maxChunks:
+                break
+            if key == self._last[0]:
+                continue
+            chunk = self._chunks[key]
+            if chunk.dirty:
+                if self.directory is None:
+                    continue
+                self._save(chunk)
+            del self._chunks[key]
+            self._bump(key)
+            self.evicted += 1
+
+    def flush(self):
+        if self.directory is None:
+            return
+        with self._lock:
+            for chunk in self._chunks.values():
+                if chunk.dirty:
+                    self._save(chunk)
+
+    def tileIndex(self, x, y):
+        size = self.chunkSize
+        return (y % size) * size + x % size
+
+    def getType(self, x, y):
+        return self.typeNames[self.chunkAt(x, y).types[self.tileIndex(x, y)]]
+
+    def getImage(self, x, y):
+        return self.imageNames[self.chunkAt(x, y).images[self.tileIndex(x, y)]]
+
+    def getCost(self, x, y):
+        return self.chunkAt(x, y).costs[self.tileIndex(x, y)]
+
+    def setType(self, x, y, name):
+        chunk = self.chunkAt(x, y)
+        chunk.types[self.tileIndex(x, y)] = self.typeId(name)
+        chunk.dirty = True
+        self._bump((chunk.cx, chunk.cy))
+
+    def setImage(self, x, y, name):
+        chunk = self.chunkAt(x, y)
+        chunk.images[self.tileIndex(x, y)] = self.imageId(name)
+        chunk.dirty = True
+        self._bump((chunk.cx, chunk.cy))
+
+    def setCost(self, x, y, cost):
+        chunk = self.chunkAt(x, y)
+        chunk.costs[self.tileIndex(x, y)] = cost
+        chunk.dirty = True
+        self._bump((chunk.cx, chunk.cy))
+
+    def __len__(self):
+        return len(self._chunks)
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+import pygame
+
+class ChunkSurfaceCache (object):
+    """
+    Terrain baked into one surface per block of chunkTiles x chunkTiles
+    tiles, so the visible map is drawn with a handful of large blits
+    instead of one per tile. Surfaces are built on first use, kept
+    least recently used first up to maxSurfaces, and the affected tile
+    is re-baked when the map reports a change.
+    """
+
+    def __init__(self, map, imageCache, tileWidth, tileHeight, chunkTiles = 8, maxSurfaces = 64):
+        self.map = map
+        self.imageCache = imageCache
+        self.tileSize = (tileWidth, tileHeight)
+        self.chunkTiles = chunkTiles
+        self.chunkSize = (tileWidth * chunkTiles, tileHeight * chunkTiles)
+        self.maxSurfaces = maxSurfaces
+        self._surfaces = OrderedDict()
+
+        map.addChangeListener(self._mapChangeListener)
+
+    def getSurface(self, cx, cy):
+        key = (cx, cy)
+        surface = self._surfaces.pop(key, None)
+        if surface is None:
+            surface = self._bake(cx, cy)
+            if len(self._surfaces) >= self.maxSurfaces:
+                self._surfaces.popitem(last = False)
+        self._surfaces[key] = surface
+        return surface
+
+    def _bake(self, cx, cy):
+        surface = pygame.Surface(self.chunkSize)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+
+        n = self.chunkTiles
+        for ty in range(n):
+            for tx in range(n):
+                self._bakeTile(surface, cx * n + tx, cy * n + ty)
+        return surface
+
+    def _bakeTile(self, surface, x, y):
+        n = self.chunkTiles
+        image = self.imageCache.getCachedSurface(self.map.getImage(x, y))
+        surface.blit(image, ((x % n) * self.tileSize[0], (y % n) * self.tileSize[1]))
+
+    def _mapChangeListener(self, x, y):
+        n = self.chunkTiles
+        surface = self._surfaces.get((x // n, y // n))
+        if surface is not None:
+            self._bakeTile(surface, x, y)
+
+    def draw(self, surface, offsetX, offsetY, rect = None):
+        """
+        Draws the terrain seen from view offset (offsetX, offsetY) into
+        rect of surface, the whole surface by default.
+        """
+        if rect is None:
+            rect = surface.get_rect()
+        chunkW, chunkH = self.chunkSize
+
+        minX = (rect.left + offsetX) // chunkW
+        maxX = (rect.right - 1 + offsetX) // chunkW
+        minY = (rect.top + offsetY) // chunkH
+        maxY = (rect.bottom - 1 + offsetY) // chunkH
+
+        clip = surface.get_clip()
+        surface.set_clip(rect)
+        for cy in range(minY, maxY + 1):
+            for cx in range(minX, maxX + 1):
+                surface.blit(self.getSurface(cx, cy), (cx * chunkW - offsetX, cy * chunkH - offsetY))
+        surface.set_clip(clip)
@@ -0,0 +1,135 @@
+from pygame import Rect
+
+from maputils import isImpassableAt
+
+def scaleRect(rect, ratio):
+    """
+    The rect pygame.sprite.collide_rect_ratio(ratio) tests with.
+    """
+    if ratio == 1.0:
+        return rect
+    return rect.inflate(rect.width * ratio - rect.width, rect.height * ratio - rect.height)
+
+class GridCollider (object):
+    """
+    Answers terrain collision queries for world space rects straight
+    from the map, looking only at the tiles a rect covers instead of
+    testing it against every tile sprite on screen. Tiles outside a
+    bounded map count as blocked.
+    """
+
+    def __init__(self, map, tileWidth, tileHeight, blocked = isImpassableAt):
+        self.map = map
+        self.tileWidth = tileWidth
+        self.tileHeight = tileHeight
+        self.blocked = blocked
+
+    def isBlocked(self, x, y):
+        m = self.map
+        if m.width is not None and (x < 0 or x >= m.width):
+            return True
+        if m.height is not None and (y < 0 or y >= m.height):
+            return True
+        return self.blocked(m, x, y)
+
+    def cellsCovering(self, rect):
+        w = self.tileWidth
+        h = self.tileHeight
+        return [(x, y)
+                for y in range(rect.top // h, (rect.bottom - 1) // h + 1)
+                for x in range(rect.left // w, (rect.right - 1) // w + 1)]
+
+    def blockedCells(self, rect, ratio = 1.0):
+        """
+        Blocked tiles that rect overlaps, both shrunk or grown by ratio
+        the way collide_rect_ratio does.
+        """
+        w = self.tileWidth
+        h = self.tileHeight
+        scaled = scaleRect(rect, ratio)
+        results = []
+        for x, y in self.cellsCovering(scaled):
+            if self.isBlocked(x, y) and scaled.colliderect(scaleRect(Rect(x * w, y * h, w, h), ratio)):
+                results.append((x, y))
+        return results
+
+    def collides(self, rect, ratio = 1.0):
+        return len(self.blockedCells(rect, ratio)) > 0
+
+class SpatialHash (object):
+    """
+    Uniform grid of cellSize pixel buckets over world space for finding
+    the objects near a rect without testing all of them. Every object is
+    listed in each bucket its rect touches; update moves it when it
+    moves and remove drops it for good.
+    """
+
+    def __init__(self, cellSize = 64):
+        self.cellSize = cellSize
+        self._buckets = {}
+        self._rects = {}
+        self._cells = {}
+
+    def _cellsFor(self, rect):
+        size = self.cellSize
+        return [(x, y)
+                for y in range(rect.top // size, (rect.bottom - 1) // size + 1)
+                for x in range(rect.left // size, (rect.right - 1) // size + 1)]
+
+    def update(self, obj, rect):
+        rect = Rect(rect)
+        self._rects[obj] = rect
+        cells = self._cellsFor(rect)
+        old = self._cells.get(obj)
+        if old == cells:
+            return
+        if old is not None:
+            self._unlink(obj, old)
+        for cell in cells:
+            bucket = self._buckets.get(cell)
+            if bucket is None:
+                bucket = self._buckets[cell] = set()
+            bucket.add(obj)
+        self._cells[obj] = cells
+
+    insert = update
+
+    def _unlink(self, obj, cells):
+        for cell in cells:
+            bucket = self._buckets[cell]
+            bucket.discard(obj)
+            if not bucket:
+                del self._buckets[cell]
+
+    def remove(self, obj):
+        cells = self._cells.pop(obj, None)
+        if cells is not None:
+            self._unlink(obj, cells)
+            del self._rects[obj]
+
+    def clear(self):
+        self._buckets.clear()
+        self._rects.clear()
+        self._cells.clear()
+
+    def rectOf(self, obj):
+        return self._rects.get(obj)
+
+    def query(self, rect, ratio = 1.0):
+        """
+        Objects whose rect overlaps rect, both scaled by ratio.
+        """
+        scaled = scaleRect(Rect(rect), ratio)
+        results = set()
+        for cell in self._cellsFor(scaled):
+            bucket = self._buckets.get(cell)
+            if bucket:
+                results.update(bucket)
+        return [obj for obj in results
+                if scaled.colliderect(scaleRect(self._rects[obj], ratio))]
+
+    def __contains__(self, obj):
+        return obj in self._cells
+
+    def __len__(self):
+        return len(self._cells)
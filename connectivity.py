@@ -0,0 +1,179 @@
+from array import array
+
+from gridastar import SQUARE_STEPS, DIAGONAL_STEPS
+from maputils import isImpassableAt
+
+# the eight tiles around a tile, in order round the ring
+RING = ((-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0))
+
+class ConnectivityIndex (object):
+    """
+    A connected component label for every tile of a width x height
+    passability grid, indexed by y*width+x like GridAStar, so whether
+    one tile can reach another is two lookups and no search.
+
+    A tile turning passable joins the components around it through a
+    union-find over labels. A tile turning impassable can split its
+    component; unless the passable tiles around it still join up
+    through each other, the pieces are relabelled by flood fill before
+    the next query.
+    """
+
+    def __init__(self, width, height, passable, diagonal = True):
+        self.width = width
+        self.height = height
+        self.passable = passable
+        self.diagonal = diagonal
+        self._steps = DIAGONAL_STEPS if diagonal else SQUARE_STEPS
+
+        self.labels = array('i', [-1]) * (width * height)
+        self._parent = []
+        self._pending = []
+        self.floods = 0
+
+        for i in range(width * height):
+            if passable[i] and self.labels[i] < 0:
+                self._flood(i, self._newLabel())
+
+    @classmethod
+    def fromMap(cls, map, diagonal = True):
+        passable = bytearray(map.width * map.height)
+        for y in range(map.height):
+            for x in range(map.width):
+                passable[y * map.width + x] = not isImpassableAt(map, x, y)
+        index = cls(map.width, map.height, passable, diagonal)
+        map.addChangeListener(index._mapChangeListener(map))
+        return index
+
+    @classmethod
+    def fromGrid(cls, grid):
+        """
+        An index sharing grid's passability and kept up to date by
+        GridAStar.setPassable.
+        """
+        index = cls(grid.width, grid.height, grid.passable, grid.diagonal)
+        grid.connectivity = index
+        return index
+
+    def _mapChangeListener(self, map):
+        def listener(x, y):
+            self.setPassable(x, y, not isImpassableAt(map, x, y))
+        return listener
+
+    def _newLabel(self):
+        self._parent.append(len(self._parent))
+        return len(self._parent) - 1
+
+    def _find(self, label):
+        parent = self._parent
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    def _union(self, a, b):
+        a = self._find(a)
+        b = self._find(b)
+        if a != b:
+            self._parent[max(a, b)] = min(a, b)
+
+    def _neighbours(self, x, y, steps):
+        w = self.width
+        h = self.height
+        return [(x + dx, y + dy) for dx, dy in steps
+                if 0 <= x + dx < w and 0 <= y + dy < h and self.passable[(y + dy) * w + x + dx]]
+
+    def _flood(self, start, label):
+        w = self.width
+        h = self.height
+        passable = self.passable
+        labels = self.labels
+        steps = [(dx, dy, dy * w + dx) for dx, dy in self._steps]
+
+        labels[start] = label
+        stack = [start]
+        while stack:
+            i = stack.pop()
+            x = i % w
+            y = i // w
+            for dx, dy, d in steps:
+                n = i + d
+                if 0 <= x + dx < w and 0 <= y + dy < h and passable[n] and labels[n] != label:
+                    labels[n] = label
+                    stack.append(n)
+        self.floods += 1
+
+    def setPassable(self, x, y, passable):
+        w = self.width
+        i = y * w + x
+        self.passable[i] = passable
+        if bool(passable) == (self.labels[i] >= 0):
+            return
+
+        if passable:
+            label = self._newLabel()
+            self.labels[i] = label
+            for nx, ny in self._neighbours(x, y, self._steps):
+                self._union(label, self.labels[ny * w + nx])
+        else:
+            self.labels[i] = -1
+            if self._mightSplit(x, y):
+                self._pending.append(i)
+
+    def _mightSplit(self, x, y):
+        # whether the tiles that were joined through (x, y) can still
+        # reach each other around the ring of tiles about it
+        neighbours = self._neighbours(x, y, self._steps)
+        if len(neighbours) <= 1:
+            return False
+
+        ring = set(self._neighbours(x, y, RING))
+        steps = self._steps
+        seen = set([neighbours[0]])
+        stack = [neighbours[0]]
+        while stack:
+            cx, cy = stack.pop()
+            for dx, dy in steps:
+                n = (cx + dx, cy + dy)
+                if n in ring and n not in seen:
+                    seen.add(n)
+                    stack.append(n)
+        for n in neighbours:
+            if n not in seen:
+                return True
+        return False
+
+    def _settle(self):
+        # relabel the pieces around every tile that may have split its
+        # component
+        w = self.width
+        fresh = set()
+        for i in self._pending:
+            if self.labels[i] >= 0:
+                continue
+            for nx, ny in self._neighbours(i % w, i // w, self._steps):
+                n = ny * w + nx
+                if self.labels[n] not in fresh:
+                    label = self._newLabel()
+                    fresh.add(label)
+                    self._flood(n, label)
+        self._pending = []
+
+    def component(self, i):
+        """
+        The component of tile id i, or -1 for an impassable tile.
+        """
+        if self._pending:
+            self._settle()
+        label = self.labels[i]
+        if label < 0:
+            return -1
+        return self._find(label)
+
+    def connected(self, a, b):
+        ca = self.component(a)
+        return ca >= 0 and ca == self.component(b)
+
+    def connectedAt(self, x1, y1, x2, y2):
+        w = self.width
+        return self.connected(y1 * w + x1, y2 * w + x2)
@@ -0,0 +1,209 @@
+from maputils import getCost, isImpassableAt
+from priorityqueueset import LazyHeap, INFINITY
+
+class DStarLite (object):
+    """
+    Incremental planner taking the same callbacks as AStar, for
+    replanning toward a goal that keeps moving over terrain that keeps
+    changing.
+
+    This is D* Lite searching forward from a root tile, the start of
+    the first query. Costs from the root do not depend on the goal, so
+    when the goal moves the search resumes where it stopped, with the
+    queue kept valid by the usual km offset, and only expands what the
+    new goal needs. A tile reported through tileChanged re-costs
+    itself and whatever routed through it.
+
+    A query from a new start keeps the search when that start lies on
+    the path from the root to the goal (a mob walking its own path)
+    and returns the rest of the path. Otherwise the search restarts
+    from the new start.
+
+    As with AStar, a path costs the sum of the costs of the tiles it
+    enters, start tile included. Neighbours must be symmetric, and the
+    heuristic must be consistent for the km offset to keep goal moves
+    exact.
+    """
+
+    def __init__(self, adjacenciesFunc, costFunc, heuristicCostFunc, impassablePred,
+                 connectivity = None):
+        self.adjacenciesFunc = adjacenciesFunc
+        self.costFunc = costFunc
+        self.heuristicCostFunc = heuristicCostFunc
+        self.impassablePred = impassablePred
+        self.connectivity = connectivity
+
+        self.root = None
+        self.goal = None
+        self.restarts = 0
+        self.nodesExpanded = 0
+
+    @classmethod
+    def fromMap(cls, map, heuristicCostFunc, diagonal = True, connectivity = None):
+        """
+        A planner over map that follows its tile changes.
+        """
+        planner = cls(map.getDiagonalAdjacencies if diagonal else map.getSquareAdjacencies,
+                      lambda elem: getCost(map, elem),
+                      heuristicCostFunc,
+                      lambda elem: isImpassableAt(map, elem.x, elem.y),
+                      connectivity)
+        map.addChangeListener(lambda x, y: planner.tileChanged(map.getMapElement(x, y)))
+        return planner
+
+    def _reset(self, root):
+        self.root = root
+        self.km = 0
+        self.g = {}
+        self.rhs = {root: self._cost(root)}
+        self.open = LazyHeap()
+        self._lastPath = set()
+        self.open.add(root, self._key(root))
+        self.restarts += 1
+
+    def _cost(self, elem):
+        if self.impassablePred(elem):
+            return INFINITY
+        return self.costFunc(elem)
+
+    def _key(self, elem):
+        m = min(self.g.get(elem, INFINITY), self.rhs.get(elem, INFINITY))
+        return (m + self.heuristicCostFunc(elem, self.goal) + self.km, m)
+
+    def _updateVertex(self, elem):
+        if self.g.get(elem, INFINITY) != self.rhs.get(elem, INFINITY):
+            self.open.add(elem, self._key(elem))
+        else:
+            self.open.remove(elem)
+
+    def _recomputeRhs(self, elem):
+        if elem == self.root:
+            self.rhs[elem] = self._cost(elem)
+            return
+        cost = self._cost(elem)
+        best = INFINITY
+        if cost < INFINITY:
+            g = self.g
+            for p in self.adjacenciesFunc(elem):
+                gp = g.get(p, INFINITY)
+                if gp < best:
+                    best = gp
+        self.rhs[elem] = best + cost
+
+    def _computeShortestPath(self):
+        g = self.g
+        rhs = self.rhs
+        goal = self.goal
+        open = self.open
+        expanded = 0
+        while True:
+            topKey = open.topKey()
+            goalRhs = rhs.get(goal, INFINITY)
+            if topKey >= self._key(goal) and goalRhs <= g.get(goal, INFINITY):
+                break
+            if topKey[0] == INFINITY:
+                break
+
+            u = open.pop()
+            newKey = self._key(u)
+            if topKey < newKey:
+                open.add(u, newKey)
+                continue
+            expanded += 1
+
+            gu = g.get(u, INFINITY)
+            if gu > rhs[u]:
+                # overconsistent: settle it and offer it to neighbours
+                gu = g[u] = rhs[u]
+                for s in self.adjacenciesFunc(u):
+                    if s == self.root:
+                        continue
+                    through = gu + self._cost(s)
+                    if through < rhs.get(s, INFINITY):
+                        rhs[s] = through
+                        self._updateVertex(s)
+            else:
+                # underconsistent: it got dearer, so anything that came
+                # through it has to look again
+                g[u] = INFINITY
+                self._recomputeRhs(u)
+                self._updateVertex(u)
+                for s in self.adjacenciesFunc(u):
+                    if s != self.root and rhs.get(s, INFINITY) == gu + self._cost(s):
+                        self._recomputeRhs(s)
+                        self._updateVertex(s)
+        self.nodesExpanded += expanded
+        return expanded
+
+    def tileChanged(self, elem):
+        """
+        Tells the planner elem changed cost or passability.
+        """
+        if self.root is None:
+            return
+        self._recomputeRhs(elem)
+        self._updateVertex(elem)
+
+    def _extractPath(self):
+        # the search may stop with the goal itself not yet settled, only
+        # its best neighbour
+        goal = self.goal
+        g = self.g
+        if self.rhs.get(goal, INFINITY) == INFINITY:
+            return []
+
+        # between equally cheap routes take the one we took last time,
+        # so a start walking that route stays on it
+        last = self._lastPath
+        path = [goal]
+        elem = goal
+        value = self.rhs[goal]
+        while elem != self.root:
+            best = None
+            bestKey = (value, False)
+            for p in self.adjacenciesFunc(elem):
+                key = (g.get(p, INFINITY), p not in last)
+                if key < bestKey:
+                    best = p
+                    bestKey = key
+            if best is None:
+                return []
+            path.append(best)
+            elem = best
+            value = bestKey[0]
+        path.reverse()
+        self._lastPath = set(path)
+        return path
+
+    def best_path(self, posA, posB, stats = None):
+        if stats is not None:
+            stats.reset()
+        if self.impassablePred(posA) or self.impassablePred(posB):
+            return []
+        connectivity = self.connectivity
+        if connectivity is not None and not connectivity.connectedAt(posA.x, posA.y, posB.x, posB.y):
+            return []
+
+        expanded = 0
+        if self.root is None:
+            self.goal = posB
+            self._reset(posA)
+        elif posB != self.goal:
+            self.km += self.heuristicCostFunc(self.goal, posB)
+            self.goal = posB
+
+        expanded += self._computeShortestPath()
+        path = self._extractPath()
+
+        if posA != self.root:
+            if posA in path:
+                path = path[path.index(posA):]
+            else:
+                self._reset(posA)
+                expanded += self._computeShortestPath()
+                path = self._extractPath()
+
+        if stats is not None:
+            stats.nodesExpanded = expanded
+            stats.nodesAllocated = len(self.rhs)
+        return path
@@ -0,0 +1,141 @@
+from heapq import heappush, heappop
+
+from gridastar import SQUARE_STEPS, DIAGONAL_STEPS
+from priorityqueueset import INFINITY
+
+# goal moves of at most this many tiles repair the existing field
+# instead of rebuilding it
+INCREMENTAL_RANGE = 8
+
+class FlowField (object):
+    """
+    Cost-to-goal for every tile of a GridAStar, computed by one reverse
+    Dijkstra from the goal, so any number of agents heading for the
+    same goal can read their next step in O(1).
+
+    Distances follow the AStar convention: the cost of getting from a
+    tile to the goal is the sum of the tiles entered on the way, so a
+    tile's full path cost is its own cost plus its distance.
+    """
+
+    def __init__(self, grid, goal = None):
+        self.grid = grid
+        self.goal = None
+        self.distances = None
+        self._stepList = [(dx, dy, dy * grid.width + dx)
+                          for (dx, dy) in (DIAGONAL_STEPS if grid.diagonal else SQUARE_STEPS)]
+        if goal is not None:
+            self.setGoal(*goal)
+
+    def setGoal(self, x, y):
+        goal = y * self.grid.width + x
+        if goal == self.goal:
+            return
+
+        old = self.goal
+        w = self.grid.width
+        if (old is not None and self.distances[old] != INFINITY and
+            max(abs(old % w - x), abs(old // w - y)) <= INCREMENTAL_RANGE):
+            self.goal = goal
+            self._moveGoal(old, goal)
+        else:
+            self.goal = goal
+            self.refresh()
+
+    def refresh(self):
+        """
+        Rebuilds the whole field, needed after the grid is edited.
+        """
+        distances = [INFINITY] * (self.grid.width * self.grid.height)
+        if self.grid.passable[self.goal]:
+            distances[self.goal] = 0
+            self._propagate(distances, [self.goal])
+        self.distances = distances
+
+    def _moveGoal(self, old, goal):
+        # going via the old goal bounds every distance from above, so
+        # only tiles that really get closer have to be visited again
+        grid = self.grid
+        path = grid.best_path_ids(old, goal)
+        if not path:
+            self.refresh()
+            return
+
+        extra = grid.pathCost(path) - grid.costs[old]
+        distances = [d + extra for d in self.distances]
+        distances[goal] = 0
+        self._propagate(distances, [goal])
+        self.distances = distances
+
+    def _propagate(self, distances, seeds):
+        # Dijkstra outwards from the seeds, only following tiles whose
+        # distance improves
+        grid = self.grid
+        w = grid.width
+        h = grid.height
+        costs = grid.costs
+        passable = grid.passable
+        steps = self._stepList
+
+        openHeap = [(distances[i], i) for i in seeds]
+        while openHeap:
+            d, node = heappop(openHeap)
+            if d > distances[node]:
+                continue
+            # every neighbour reaches the goal by entering this tile
+            nd = d + costs[node]
+            x = node % w
+            y = node // w
+            for dx, dy, step in steps:
+                nx = x + dx
+                ny = y + dy
+                if nx < 0 or nx >= w or ny < 0 or ny >= h:
+                    continue
+                n = node + step
+                if nd < distances[n] and passable[n]:
+                    distances[n] = nd
+                    heappush(openHeap, (nd, n))
+
+    def distanceAt(self, x, y):
+        return self.distances[y * self.grid.width + x]
+
+    def nextStep(self, x, y):
+        """
+        Returns the (x, y) tile to move to next from (x, y), or None at
+        the goal or when the goal can not be reached.
+        """
+        grid = self.grid
+        w = grid.width
+        h = grid.height
+        node = y * w + x
+        distances = self.distances
+        if node == self.goal or distances[node] == INFINITY:
+            return None
+
+        costs = grid.costs
+        best = None
+        bestCost = INFINITY
+        for dx, dy, step in self._stepList:
+            nx = x + dx
+            ny = y + dy
+            if nx < 0 or nx >= w or ny < 0 or ny >= h:
+                continue
+            n = node + step
+            cost = distances[n] + costs[n]
+            if cost < bestCost:
+                best = (nx, ny)
+                bestCost = cost
+        return best
+
+    def nextSteps(self, positions):
+        return [self.nextStep(x, y) for (x, y) in positions]
+
+    def pathFrom(self, x, y):
+        if self.distances[y * self.grid.width + x] == INFINITY:
+            return []
+        results = [(x, y)]
+        step = self.nextStep(x, y)
+        while step is not None:
+            results.append(step)
+            step = self.nextStep(*step)
+        return results
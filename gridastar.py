@@ -0,0 +1,404 @@
+from array import array
+from heapq import heappush, heappop
+
+from maputils import getCost, isImpassable
+from priorityqueueset import INFINITY
+from profiler import profiler
+
+# (dx, dy) steps, matching Map.getSquareAdjacencies and
+# Map.getDiagonalAdjacencies
+SQUARE_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL_STEPS = SQUARE_STEPS + ((-1, -1), (1, -1), (-1, 1), (1, 1))
+
+class GridAStar (object):
+    """
+    A* over a flat grid of tile costs and a passability bitmap, both
+    indexed by y*width+x. Nodes are plain integer ids so a search
+    allocates no per-node objects and makes no callbacks.
+
+    costs and passable can be anything indexable by id: lists,
+    array.array, bytearray or NumPy arrays. As with AStar, the cost of
+    a path is the sum of the costs of the tiles it enters, starting
+    with the start tile itself.
+    """
+
+    def __init__(self, width, height, costs, passable, diagonal = True):
+        self.width = width
+        self.height = height
+        self.costs = costs
+        self.passable = passable
+        self.diagonal = diagonal
+        self._costCounts = None
+        self._minCost = None
+        self._maxCost = None
+        self._padded = None
+        # set by ConnectivityIndex.fromGrid
+        self.connectivity = None
+
+    @classmethod
+    def fromMap(cls, map, diagonal = True):
+        costs = array('d')
+        passable = bytearray(map.width * map.height)
+        for y in range(map.height):
+            for x in range(map.width):
+                elem = map.getMapElement(x, y)
+                costs.append(getCost(map, elem))
+                passable[y * map.width + x] = not isImpassable(elem)
+        return cls(map.width, map.height, costs, passable, diagonal)
+
+    def setCost(self, x, y, cost):
+        i = y * self.width + x
+        counted = self._costCounts is not None and self.passable[i]
+        if counted:
+            self._costRemoved(self.costs[i])
+        self.costs[i] = cost
+        if counted:
+            # as stored, which a float32 array rounds
+            self._costAdded(self.costs[i])
+
+    def setPassable(self, x, y, passable):
+        i = y * self.width + x
+        if self._costCounts is not None and bool(self.passable[i]) != bool(passable):
+            if passable:
+                self._costAdded(self.costs[i])
+            else:
+                self._costRemoved(self.costs[i])
+        self.passable[i] = passable
+        if self._padded is not None:
+            self._padded[(y + 1) * (self.width + 2) + x + 1] = bool(passable)
+        if self.connectivity is not None:
+            self.connectivity.setPassable(x, y, passable)
+
+    def _costAdded(self, cost):
+        counts = self._costCounts
+        counts[cost] = counts.get(cost, 0) + 1
+        self._minCost = min(self._minCost, cost)
+        self._maxCost = max(self._maxCost, cost)
+
+    def _costRemoved(self, cost):
+        counts = self._costCounts
+        counts[cost] -= 1
+        if not counts[cost]:
+            del counts[cost]
+            if cost == self._minCost or cost == self._maxCost:
+                self._setCostRange()
+
+    def invalidate(self):
+        # drops everything derived from the arrays, for when they were
+        # written to directly
+        self._costCounts = None
+        self._padded = None
+
+    def _updateCostRange(self):
+        # the number of passable tiles at each cost, which edits keep
+        # up to date so that they never rescan the grid
+        costs = self.costs
+        passable = self.passable
+        counts = {}
+        for i in range(self.width * self.height):
+            if passable[i]:
+                counts[costs[i]] = counts.get(costs[i], 0) + 1
+        self._costCounts = counts
+        self._setCostRange()
+
+    def _setCostRange(self):
+        # an empty range, min above max, when nothing is passable
+        self._minCost = min(self._costCounts or [INFINITY])
+        self._maxCost = max(self._costCounts or [-INFINITY])
+
+    def minCost(self):
+        # cheapest passable tile, which scales the heuristic so that it
+        # stays admissible
+        if self._costCounts is None:
+            self._updateCostRange()
+        if self._minCost > self._maxCost:
+            return 0
+        return self._minCost
+
+    def isUniform(self):
+        if self._costCounts is None:
+            self._updateCostRange()
+        return self._minCost >= self._maxCost
+
+    def heuristic(self, a, b):
+        dx = abs(a % self.width - b % self.width)
+        dy = abs(a // self.width - b // self.width)
+        if self.diagonal:
+            # a diagonal step costs the same as a straight one
+            return max(dx, dy) * self.minCost()
+        return (dx + dy) * self.minCost()
+
+    def best_path(self, posA, posB, stats = None, mode = 'astar'):
+        """
+        Returns the list of (x, y) tiles from posA to posB inclusive,
+        or [] when there is no path.
+
+        mode is 'astar' or 'jps'. Jump Point Search is only used on
+        8-connected grids where every passable tile has the same cost,
+        otherwise the query falls back to plain A*.
+        """
+        w = self.width
+        ids = self.best_path_ids(posA[1] * w + posA[0], posB[1] * w + posB[0], stats, mode)
+        return [(i % w, i // w) for i in ids]
+
+    def best_path_ids(self, start, goal, stats = None, mode = 'astar', bounds = None):
+        """
+        As best_path but on tile ids. bounds is an optional
+        (minX, minY, maxX, maxY) half-open box the search may not
+        leave, which always uses plain A*.
+        """
+        if stats is not None:
+            stats.reset()
+
+        if self.connectivity is not None and not self.connectivity.connected(start, goal):
+            return []
+
+        with profiler.scope('gridastar'):
+            if mode == 'jps' and bounds is None and self.diagonal and self.isUniform():
+                return self._jps(start, goal, stats)
+            return self._astar(start, goal, stats, bounds or (0, 0, self.width, self.height))
+
+    def pathCost(self, ids):
+        costs = self.costs
+        return sum([costs[i] for i in ids])
+
+    def _astar(self, start, goal, stats, bounds):
+        costs = self.costs
+        passable = self.passable
+        if not passable[start] or not passable[goal]:
+            return []
+
+        w = self.width
+        minX, minY, maxX, maxY = bounds
+        steps = [(dx, dy, dy * w + dx)
+                 for (dx, dy) in (DIAGONAL_STEPS if self.diagonal else SQUARE_STEPS)]
+        diagonal = self.diagonal
+        scale = self.minCost()
+        gx = goal % w
+        gy = goal // w
+
+        gScore = {start: costs[start]}
+        parents = {start: -1}
+        closed = set()
+        # ties on f are broken towards the node nearest the goal
+        openHeap = [(costs[start], 0, start)]
+
+        found = False
+        while openHeap:
+            f, hCost, node = heappop(openHeap)
+            if node in closed:
+                continue
+            if node == goal:
+                found = True
+                break
+            closed.add(node)
+
+            g = gScore[node]
+            x = node % w
+            y = node // w
+            for dx, dy, step in steps:
+                nx = x + dx
+                ny = y + dy
+                if nx < minX or nx >= maxX or ny < minY or ny >= maxY:
+                    continue
+                n = node + step
+                if n in closed or not passable[n]:
+                    continue
+                ng = g + costs[n]
+                old = gScore.get(n)
+                if old is not None and old <= ng:
+                    continue
+                gScore[n] = ng
+                parents[n] = node
+                ddx = abs(nx - gx)
+                ddy = abs(ny - gy)
+                if diagonal:
+                    nh = (ddx if ddx > ddy else ddy) * scale
+                else:
+                    nh = (ddx + ddy) * scale
+                heappush(openHeap, (ng + nh, nh, n))
+
+        if stats is not None:
+            stats.nodesExpanded = len(closed)
+            stats.nodesAllocated = len(gScore)
+
+        if not found:
+            return []
+
+        results = []
+        node = goal
+        while node != -1:
+            results.append(node)
+            node = parents[node]
+        results.reverse()
+        return results
+
+    def _paddedPassable(self):
+        # the passability bitmap surrounded by a one tile blocked border
+        # so that jumps need no bounds checks
+        if self._padded is None:
+            w = self.width
+            pw = w + 2
+            passable = self.passable
+            padded = bytearray(pw * (self.height + 2))
+            for y in range(self.height):
+                row = (y + 1) * pw + 1
+                for x in range(w):
+                    if passable[y * w + x]:
+                        padded[row + x] = 1
+            self._padded = padded
+        return self._padded
+
+    def _jps(self, start, goal, stats):
+        if not self.passable[start] or not self.passable[goal]:
+            return []
+
+        # the search runs on ids into the padded bitmap
+        w = self.width
+        pw = w + 2
+        pp = self._paddedPassable()
+        cost = self.costs[start]
+        pStart = (start // w + 1) * pw + start % w + 1
+        pGoal = (goal // w + 1) * pw + goal % w + 1
+        gx = pGoal % pw
+        gy = pGoal // pw
+
+        def jumpStraight(i, dx, dy):
+            if dx:
+                while True:
+                    i += dx
+                    if not pp[i]:
+                        return -1
+                    if i == pGoal:
+                        return i
+                    if ((not pp[i + pw] and pp[i + pw + dx]) or
+                        (not pp[i - pw] and pp[i - pw + dx])):
+                        return i
+            step = dy * pw
+            while True:
+                i += step
+                if not pp[i]:
+                    return -1
+                if i == pGoal:
+                    return i
+                if ((not pp[i + 1] and pp[i + 1 + step]) or
+                    (not pp[i - 1] and pp[i - 1 + step])):
+                    return i
+
+        def jump(i, dx, dy):
+            if not dx or not dy:
+                return jumpStraight(i, dx, dy)
+            vertical = dy * pw
+            step = vertical + dx
+            while True:
+                i += step
+                if not pp[i]:
+                    return -1
+                if i == pGoal:
+                    return i
+                if ((not pp[i - dx] and pp[i - dx + vertical]) or
+                    (not pp[i - vertical] and pp[i + dx - vertical])):
+                    return i
+                if jumpStraight(i, dx, 0) != -1 or jumpStraight(i, 0, dy) != -1:
+                    return i
+
+        def directions(i, parent):
+            if parent == -1:
+                return [(dx, dy) for (dx, dy) in DIAGONAL_STEPS if pp[i + dy * pw + dx]]
+
+            x = i % pw
+            y = i // pw
+            px = parent % pw
+            py = parent // pw
+            dx = (x > px) - (x < px)
+            dy = (y > py) - (y < py)
+            vertical = dy * pw
+            results = []
+            if dx and dy:
+                if pp[i + vertical]:
+                    results.append((0, dy))
+                if pp[i + dx]:
+                    results.append((dx, 0))
+                if pp[i + vertical + dx]:
+                    results.append((dx, dy))
+                if not pp[i - dx] and pp[i - dx + vertical]:
+                    results.append((-dx, dy))
+                if not pp[i - vertical] and pp[i + dx - vertical]:
+                    results.append((dx, -dy))
+            elif dx:
+                if pp[i + dx]:
+                    results.append((dx, 0))
+                if not pp[i + pw] and pp[i + pw + dx]:
+                    results.append((dx, 1))
+                if not pp[i - pw] and pp[i - pw + dx]:
+                    results.append((dx, -1))
+            else:
+                if pp[i + vertical]:
+                    results.append((0, dy))
+                if not pp[i + 1] and pp[i + 1 + vertical]:
+                    results.append((1, dy))
+                if not pp[i - 1] and pp[i - 1 + vertical]:
+                    results.append((-1, dy))
+            return results
+
+        gScore = {pStart: cost}
+        parents = {pStart: -1}
+        closed = set()
+        openHeap = [(cost, 0, pStart)]
+
+        found = False
+        while openHeap:
+            f, hCost, node = heappop(openHeap)
+            if node in closed:
+                continue
+            if node == pGoal:
+                found = True
+                break
+            closed.add(node)
+
+            g = gScore[node]
+            x = node % pw
+            y = node // pw
+            for dx, dy in directions(node, parents[node]):
+                n = jump(node, dx, dy)
+                if n == -1 or n in closed:
+                    continue
+                nx = n % pw
+                ny = n // pw
+                # every step along a jump, straight or diagonal, enters
+                # one tile
+                ng = g + max(abs(nx - x), abs(ny - y)) * cost
+                old = gScore.get(n)
+                if old is not None and old <= ng:
+                    continue
+                gScore[n] = ng
+                parents[n] = node
+                nh = max(abs(nx - gx), abs(ny - gy)) * cost
+                heappush(openHeap, (ng + nh, nh, n))
+
+        if stats is not None:
+            stats.nodesExpanded = len(closed)
+            stats.nodesAllocated = len(gScore)
+
+        if not found:
+            return []
+
+        # expand the jump points back out into every tile on the path
+        results = []
+        node = pGoal
+        while node != -1:
+            parent = parents[node]
+            results.append(node)
+            if parent != -1:
+                x = node % pw
+                y = node // pw
+                dx = (parent % pw > x) - (parent % pw < x)
+                dy = (parent // pw > y) - (parent // pw < y)
+                step = dy * pw + dx
+                i = node + step
+                while i != parent:
+                    results.append(i)
+                    i += step
+            node = parent
+        results.reverse()
+        return [(i // pw - 1) * w + i % pw - 1 for i in results]
@@ -0,0 +1,316 @@
+from heapq import heappush, heappop
+
+from gridastar import GridAStar
+from maputils import getCost, isImpassableAt
+
+# entrances at least this long get a transition at each end rather than
+# a single one in the middle
+LONG_ENTRANCE = 6
+
+class HPAStar (object):
+    """
+    Hierarchical planner over a GridAStar. The grid is split into
+    square clusters; transitions are placed on passable stretches of
+    each cluster border and the costs between the transitions of a
+    cluster are precomputed with GridAStar restricted to that cluster.
+    Long queries are answered on this abstract graph and only the
+    segments on the chosen route are refined into tiles.
+
+    Edits through setCost/setPassable (or maputils.setCost/setType on a
+    map attached with fromMap) only mark the touched clusters, which
+    are rebuilt before the next query.
+    """
+
+    def __init__(self, grid, clusterSize = 16):
+        self.grid = grid
+        self.clusterSize = clusterSize
+        self.clustersX = (grid.width + clusterSize - 1) // clusterSize
+        self.clustersY = (grid.height + clusterSize - 1) // clusterSize
+
+        # (clusterA, clusterB) -> [(tileA, tileB)], clusterA < clusterB
+        self.borders = {}
+        # cluster -> {tile: [(tile, cost)]}
+        self.intraEdges = {}
+        # tile -> [(tile, cost)] across cluster borders
+        self.interEdges = {}
+
+        self._dirtyBorders = set()
+        self._dirtyClusters = set()
+
+        for cluster in range(self.clustersX * self.clustersY):
+            cx = cluster % self.clustersX
+            cy = cluster // self.clustersX
+            if cx + 1 < self.clustersX:
+                self._dirtyBorders.add((cluster, cluster + 1))
+            if cy + 1 < self.clustersY:
+                self._dirtyBorders.add((cluster, cluster + self.clustersX))
+            self._dirtyClusters.add(cluster)
+        self._repair()
+
+    @classmethod
+    def fromMap(cls, map, clusterSize = 16):
+        planner = cls(GridAStar.fromMap(map), clusterSize)
+        map.addChangeListener(planner._mapChangeListener(map))
+        return planner
+
+    def _mapChangeListener(self, map):
+        def listener(x, y):
+            self.setCost(x, y, getCost(map, map.getMapElement(x, y)))
+            self.setPassable(x, y, not isImpassableAt(map, x, y))
+        return listener
+
+    def clusterOf(self, tile):
+        w = self.grid.width
+        return ((tile // w) // self.clusterSize) * self.clustersX + (tile % w) // self.clusterSize
+
+    def clusterBounds(self, cluster):
+        size = self.clusterSize
+        x = (cluster % self.clustersX) * size
+        y = (cluster // self.clustersX) * size
+        return (x, y, min(x + size, self.grid.width), min(y + size, self.grid.height))
+
+    def setCost(self, x, y, cost):
+        if self.grid.costs[y * self.grid.width + x] != cost:
+            self.grid.setCost(x, y, cost)
+            self._tileChanged(x, y)
+
+    def setPassable(self, x, y, passable):
+        if bool(self.grid.passable[y * self.grid.width + x]) != bool(passable):
+            self.grid.setPassable(x, y, passable)
+            self._tileChanged(x, y)
+
+    def _tileChanged(self, x, y):
+        cluster = self.clusterOf(y * self.grid.width + x)
+        self._dirtyClusters.add(cluster)
+
+        # a tile on the cluster edge also moves the entrances shared
+        # with the cluster on the other side
+        minX, minY, maxX, maxY = self.clusterBounds(cluster)
+        neighbours = []
+        if x == minX and minX > 0:
+            neighbours.append(cluster - 1)
+        if x == maxX - 1 and maxX < self.grid.width:
+            neighbours.append(cluster + 1)
+        if y == minY and minY > 0:
+            neighbours.append(cluster - self.clustersX)
+        if y == maxY - 1 and maxY < self.grid.height:
+            neighbours.append(cluster + self.clustersX)
+        for other in neighbours:
+            self._dirtyBorders.add((min(cluster, other), max(cluster, other)))
+            self._dirtyClusters.add(other)
+
+    def _repair(self):
+        for border in self._dirtyBorders:
+            self._buildBorder(*border)
+        for cluster in self._dirtyClusters:
+            self._buildCluster(cluster)
+        self._dirtyBorders = set()
+        self._dirtyClusters = set()
+
+    def _buildBorder(self, clusterA, clusterB):
+        grid = self.grid
+        w = grid.width
+        passable = grid.passable
+        minX, minY, maxX, maxY = self.clusterBounds(clusterA)
+
+        if clusterB == clusterA + 1 and self.clustersX > 1:
+            # vertical border, tiles step down the shared edge
+            first = minY * w + maxX - 1
+            span = maxY - minY
+            step = w
+            across = 1
+        else:
+            first = (maxY - 1) * w + minX
+            span = maxX - minX
+            step = 1
+            across = w
+
+        transitions = []
+        run = []
+        for i in range(span + 1):
+            tile = first + i * step
+            if i < span and passable[tile] and passable[tile + across]:
+                run.append(tile)
+                continue
+            if len(run) >= LONG_ENTRANCE:
+                transitions.append(run[0])
+                transitions.append(run[-1])
+            elif run:
+                transitions.append(run[len(run) // 2])
+            run = []
+
+        old = self.borders.get((clusterA, clusterB), [])
+        for a, b in old:
+            self.interEdges[a] = [e for e in self.interEdges.get(a, []) if e[0] != b]
+            self.interEdges[b] = [e for e in self.interEdges.get(b, []) if e[0] != a]
+
+        pairs = [(tile, tile + across) for tile in transitions]
+        for a, b in pairs:
+            self.interEdges.setdefault(a, []).append((b, grid.costs[b]))
+            self.interEdges.setdefault(b, []).append((a, grid.costs[a]))
+        self.borders[(clusterA, clusterB)] = pairs
+
+    def transitionsOf(self, cluster):
+        tiles = set()
+        cx = cluster % self.clustersX
+        cy = cluster // self.clustersX
+        for other, side in ((cluster - 1, 1), (cluster + 1, 0),
+                            (cluster - self.clustersX, 1), (cluster + self.clustersX, 0)):
+            ox = other % self.clustersX
+            oy = other // self.clustersX
+            if other < 0 or abs(ox - cx) + abs(oy - cy) != 1:
+                continue
+            for pair in self.borders.get((min(cluster, other), max(cluster, other)), []):
+                tiles.add(pair[side])
+        return sorted(tiles)
+
+    def _buildCluster(self, cluster):
+        grid = self.grid
+        costs = grid.costs
+        bounds = self.clusterBounds(cluster)
+        tiles = self.transitionsOf(cluster)
+
+        edges = dict((tile, []) for tile in tiles)
+        for i in range(len(tiles)):
+            for j in range(i + 1, len(tiles)):
+                a = tiles[i]
+                b = tiles[j]
+                path = grid.best_path_ids(a, b, bounds = bounds)
+                if not path:
+                    continue
+                # the same tiles are optimal both ways, each direction
+                # just leaves out its own start tile
+                cost = grid.pathCost(path)
+                edges[a].append((b, cost - costs[a]))
+                edges[b].append((a, cost - costs[b]))
+        self.intraEdges[cluster] = edges
+
+    def _endpointEdges(self, tile, toTransitions):
+        # temporary edges between a query endpoint and the transitions
+        # of its cluster
+        grid = self.grid
+        cluster = self.clusterOf(tile)
+        bounds = self.clusterBounds(cluster)
+        edges = []
+        for t in self.transitionsOf(cluster):
+            if t == tile:
+                continue
+            if toTransitions:
+                path = grid.best_path_ids(tile, t, bounds = bounds)
+                if path:
+                    edges.append((t, grid.pathCost(path) - grid.costs[tile]))
+            else:
+                path = grid.best_path_ids(t, tile, bounds = bounds)
+                if path:
+                    edges.append((t, grid.pathCost(path) - grid.costs[t]))
+        return edges
+
+    def best_path(self, posA, posB, stats = None):
+        w = self.grid.width
+        ids = self.best_path_ids(posA[1] * w + posA[0], posB[1] * w + posB[0], stats)
+        return [(i % w, i // w) for i in ids]
+
+    def best_path_ids(self, start, goal, stats = None):
+        if self._dirtyClusters:
+            self._repair()
+        if stats is not None:
+            stats.reset()
+
+        grid = self.grid
+        w = grid.width
+        if not grid.passable[start] or not grid.passable[goal]:
+            return []
+        if grid.connectivity is not None and not grid.connectivity.connected(start, goal):
+            return []
+
+        # short hops are cheaper to search directly
+        if (max(abs(start % w - goal % w), abs(start // w - goal // w)) <= self.clusterSize or
+            self.clusterOf(start) == self.clusterOf(goal)):
+            return grid.best_path_ids(start, goal, stats)
+
+        route = self._abstractPath(start, goal, stats)
+        if not route:
+            # the abstract graph only crosses borders straight, so a
+            # route squeezing through a diagonal gap needs a full search
+            return grid.best_path_ids(start, goal)
+        return self._refine(route)
+
+    def _abstractPath(self, start, goal, stats):
+        grid = self.grid
+        w = grid.width
+        diagonal = grid.diagonal
+        scale = grid.minCost()
+        gx = goal % w
+        gy = goal // w
+
+        startEdges = self._endpointEdges(start, True)
+        goalEdges = {}
+        for t, cost in self._endpointEdges(goal, False):
+            goalEdges[t] = cost
+
+        gScore = {start: grid.costs[start]}
+        parents = {start: -1}
+        closed = set()
+        openHeap = [(gScore[start], 0, start)]
+
+        found = False
+        while openHeap:
+            f, hCost, node = heappop(openHeap)
+            if node in closed:
+                continue
+            if node == goal:
+                found = True
+                break
+            closed.add(node)
+
+            g = gScore[node]
+            edges = self.intraEdges[self.clusterOf(node)].get(node, []) + self.interEdges.get(node, [])
+            if node == start:
+                edges = edges + startEdges
+            if node in goalEdges:
+                edges = edges + [(goal, goalEdges[node])]
+
+            for n, cost in edges:
+                if n in closed:
+                    continue
+                ng = g + cost
+                old = gScore.get(n)
+                if old is not None and old <= ng:
+                    continue
+                gScore[n] = ng
+                parents[n] = node
+                dx = abs(n % w - gx)
+                dy = abs(n // w - gy)
+                if diagonal:
+                    nh = max(dx, dy) * scale
+                else:
+                    nh = (dx + dy) * scale
+                heappush(openHeap, (ng + nh, nh, n))
+
+        if stats is not None:
+            stats.nodesExpanded = len(closed)
+            stats.nodesAllocated = len(gScore)
+
+        if not found:
+            return []
+
+        route = []
+        node = goal
+        while node != -1:
+            route.append(node)
+            node = parents[node]
+        route.reverse()
+        return route
+
+    def _refine(self, route):
+        grid = self.grid
+        results = [route[0]]
+        for a, b in zip(route, route[1:]):
+            cluster = self.clusterOf(a)
+            if cluster != self.clusterOf(b):
+                # an inter-cluster edge is a single step
+                results.append(b)
+                continue
+            segment = grid.best_path_ids(a, b, bounds = self.clusterBounds(cluster))
+            results.extend(segment[1:])
+        return results
@@ -1,8 +1,32 @@
+import os
+from multiprocessing.pool import ThreadPool
+
 import pygame
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
 class ImageCache (object):
+    """
+    Images by name. Once a display mode is set, images are converted to
+    its pixel format (keeping per-pixel alpha where the file has it) so
+    blits do not convert every pixel again; images loaded before that
+    are converted by convertAll.
+
+    preload decodes whole directories on a pool of threads, and
+    buildAtlas packs the cached images into one opaque and one alpha
+    sheet, leaving subsurfaces of them in the cache.
+    """
+
     def __init__(self):
         self.cache = {}
+        self.atlases = []
+
+    def _prepare(self, image):
+        if pygame.display.get_surface() is None:
+            return image
+        if image.get_flags() & pygame.SRCALPHA:
+            return image.convert_alpha()
+        return image.convert()
 
     def getSurface(self, filename, name = None):
         if name == None:
@@ -10,10 +34,103 @@ class ImageCache (object):
 
         if name in self.cache:
             return self.cache[name]
+        elif filename in self.cache:
+            # preloaded under its file name
+            image = self.cache[filename]
         else:
-            image = pygame.image.load(filename)
-            self.cache[name] = image
-            return image
+            image = self._prepare(pygame.image.load(filename))
+        self.cache[name] = image
+        return image
 
     def getCachedSurface(self, name):
         return self.cache[name]
+
+    def convertAll(self):
+        converted = {}
+        for name, image in self.cache.iteritems():
+            if image not in converted:
+                converted[image] = self._prepare(image)
+            self.cache[name] = converted[image]
+
+    def preload(self, directories, workers = 4):
+        """
+        Loads every image under directories, cached by path, decoding
+        them on workers threads. Returns the paths loaded.
+        """
+        paths = []
+        for directory in directories:
+            for filename in sorted(os.listdir(directory)):
+                path = os.path.join(directory, filename)
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS and path not in self.cache:
+                    paths.append(path)
+
+        pool = ThreadPool(workers)
+        try:
+            images = pool.map(pygame.image.load, paths)
+        finally:
+            pool.close()
+            pool.join()
+
+        for path, image in zip(paths, images):
+            self.cache[path] = self._prepare(image)
+        return paths
+
+    def buildAtlas(self, maxWidth = 1024):
+        """
+        Copies every cached image into a shared sheet, opaque and
+        per-pixel alpha images into separate ones, and replaces the
+        cache entries with subsurfaces of the sheets. Surfaces fetched
+        before this keep working but are no longer the cached ones.
+        """
+        opaque = []
+        alpha = []
+        seen = set()
+        for name in sorted(self.cache.keys()):
+            image = self.cache[name]
+            if image in seen:
+                continue
+            seen.add(image)
+            if image.get_flags() & pygame.SRCALPHA:
+                alpha.append(image)
+            else:
+                opaque.append(image)
+
+        handles = {}
+        for images, flags in ((opaque, 0), (alpha, pygame.SRCALPHA)):
+            if images:
+                handles.update(self._pack(images, flags, maxWidth))
+
+        for name, image in self.cache.items():
+            self.cache[name] = handles[image]
+
+    def _pack(self, images, flags, maxWidth):
+        # shelves of images sorted tallest first
+        images = sorted(images, key = lambda image: -image.get_height())
+        positions = []
+        x = y = shelfHeight = width = 0
+        for image in images:
+            w, h = image.get_size()
+            if x > 0 and x + w > maxWidth:
+                x = 0
+                y += shelfHeight
+                shelfHeight = 0
+            positions.append((x, y))
+            x += w
+            width = max(width, x)
+            shelfHeight = max(shelfHeight, h)
+
+        sheet = pygame.Surface((width, y + shelfHeight), flags)
+        if flags:
+            sheet.fill((0, 0, 0, 0))
+        sheet = self._prepare(sheet)
+        self.atlases.append(sheet)
+
+        handles = {}
+        for image, pos in zip(images, positions):
+            if flags:
+                # copy the alpha as is rather than blending onto the sheet
+                sheet.blit(image, pos, special_flags = pygame.BLEND_RGBA_MAX)
+            else:
+                sheet.blit(image, pos)
+            handles[image] = sheet.subsurface(pygame.Rect(pos, image.get_size()))
+        return handles
@@ -0,0 +1,182 @@
+import os
+from array import array
+from random import Random
+
+from connectivity import ConnectivityIndex
+from flowfield import FlowField
+from gridastar import GridAStar
+from maputils import getCost, isImpassableAt
+from priorityqueueset import INFINITY
+
+# summing costs in a different order can land a table an ulp or so
+# away from the true cost, so every bound gives up this fraction of
+# the distances it was made from
+MARGIN = 1e-9
+
+class LandmarkHeuristic (object):
+    """
+    ALT heuristic: exact costs to a handful of landmark tiles, and the
+    triangle inequality turns them into a lower bound on the cost
+    between any two tiles that is far tighter than a distance estimate
+    on maps with mixed costs.
+
+    tables[k][v] is the cost of the cheapest path from tile v to
+    landmark k (tiles entered after v, the landmark included), as
+    FlowField computes it; unreachable tiles hold infinity. Tables are
+    doubles: float32 rounding grows with the distance to the landmark
+    and could push a bound past the true cost. Paths are
+    costed as in AStar, where a path starts by entering its start tile,
+    so the cost from the landmark to v follows from the one back with
+    the two tile costs swapped, and one table per landmark gives both
+    bounds.
+
+    Tables describe the costs they were built from. Once the grid is
+    edited the heuristic is stale: it falls back to the grid's own
+    distance heuristic, which stays admissible, until rebuild.
+    """
+
+    def __init__(self, grid, landmarks, tables, costs):
+        self.grid = grid
+        self.landmarks = landmarks
+        self.tables = tables
+        self.costs = costs
+        self.stale = False
+        self._goal = None
+
+    @classmethod
+    def build(cls, grid, count = 8, seed = 0):
+        landmarks, tables = cls._pickLandmarks(grid, count, seed)
+        return cls(grid, landmarks, tables, array('d', grid.costs))
+
+    @classmethod
+    def _pickLandmarks(cls, grid, count, seed):
+        # landmarks spread out by farthest point selection over the
+        # largest connected area, starting from a random tile in it
+        index = ConnectivityIndex(grid.width, grid.height, grid.passable, grid.diagonal)
+        sizes = {}
+        for i in range(grid.width * grid.height):
+            label = index.component(i)
+            if label >= 0:
+                sizes[label] = sizes.get(label, 0) + 1
+        if not sizes:
+            return [], []
+        largest = max(sizes.keys(), key = lambda label: sizes[label])
+        area = [i for i in range(grid.width * grid.height) if index.component(i) == largest]
+
+        nearest = cls._distances(grid, Random(seed).choice(area))
+        landmarks = []
+        tables = []
+        for k in range(min(count, len(area))):
+            landmark = max(area, key = lambda i: nearest[i])
+            table = cls._distances(grid, landmark)
+            landmarks.append(landmark)
+            tables.append(table)
+            nearest = [min(a, b) for a, b in zip(nearest, table)] if k else table
+        return landmarks, tables
+
+    @classmethod
+    def _distances(cls, grid, tile):
+        w = grid.width
+        return array('d', FlowField(grid, (tile % w, tile // w)).distances)
+
+    @classmethod
+    def fromMap(cls, map, count = 8, path = None, diagonal = True):
+        """
+        A heuristic over a bounded map that notices its edits. With a
+        path, tables are read from there when present and written there
+        after building; by default that is a 'landmarks' file in the
+        map's chunk directory, if it has one.
+        """
+        if path is None and map.store.directory is not None:
+            path = os.path.join(map.store.directory, 'landmarks')
+
+        grid = GridAStar.fromMap(map, diagonal)
+        heuristic = None
+        if path is not None and os.path.exists(path):
+            heuristic = cls.load(path, grid)
+            if heuristic.costs != array('d', grid.costs):
+                # saved for another version of the map
+                heuristic = None
+        if heuristic is None:
+            heuristic = cls.build(grid, count)
+            if path is not None:
+                heuristic.save(path)
+        map.addChangeListener(heuristic._mapChangeListener(map))
+        return heuristic
+
+    def _mapChangeListener(self, map):
+        def listener(x, y):
+            self.grid.setCost(x, y, getCost(map, map.getMapElement(x, y)))
+            self.grid.setPassable(x, y, not isImpassableAt(map, x, y))
+            self.stale = True
+        return listener
+
+    def rebuild(self, seed = 0):
+        self.landmarks, self.tables = self._pickLandmarks(self.grid, len(self.landmarks), seed)
+        self.costs = array('d', self.grid.costs)
+        self.stale = False
+        self._goal = None
+
+    def heuristicIds(self, a, b):
+        if self.stale:
+            return self.grid.heuristic(a, b)
+
+        if b != self._goal:
+            # every query of one search shares the goal
+            self._goal = b
+            self._goalDistances = [(table[b], table[b] + self.costs[b]) for table in self.tables]
+
+        costA = self.costs[a]
+        best = 0.0
+        for table, (toGoal, fromGoal) in zip(self.tables, self._goalDistances):
+            toLandmark = table[a]
+            if toLandmark == INFINITY or toGoal == INFINITY:
+                if toLandmark != toGoal:
+                    # only one of them reaches the landmark, so neither
+                    # reaches the other
+                    return INFINITY
+                continue
+            bound = (max(toLandmark - toGoal, fromGoal - toLandmark - costA) -
+                     (toLandmark + toGoal) * MARGIN)
+            if bound > best:
+                best = bound
+        return best
+
+    def heuristic(self, elem1, elem2):
+        """
+        Drop-in heuristicCostFunc for AStar over the same map.
+        """
+        w = self.grid.width
+        return self.heuristicIds(elem1.y * w + elem1.x, elem2.y * w + elem2.x)
+
+    def save(self, path):
+        grid = self.grid
+        f = open(path, 'wb')
+        f.write('%d %d %d d\n' % (grid.width, grid.height, int(grid.diagonal)))
+        f.write(' '.join([str(landmark) for landmark in self.landmarks]) + '\n')
+        f.write(self.costs.tostring())
+        for table in self.tables:
+            f.write(table.tostring())
+        f.close()
+
+    @classmethod
+    def load(cls, path, grid):
+        f = open(path, 'rb')
+        header = f.readline().split()
+        landmarks = [int(landmark) for landmark in f.readline().split()]
+        data = f.read()
+        f.close()
+
+        width, height, diagonal = [int(value) for value in header[:3]]
+        # files without a type code were written as float32
+        typecode = header[3] if len(header) > 3 else 'f'
+        if (width, height, bool(diagonal)) != (grid.width, grid.height, bool(grid.diagonal)):
+            raise ValueError('landmarks in %s are for a %dx%d grid' % (path, width, height))
+
+        tiles = width * height
+        values = array(typecode)
+        values.fromstring(data)
+        values = array('d', values)
+        costs = values[:tiles]
+        tables = [values[(k + 1) * tiles:(k + 2) * tiles] for k in range(len(landmarks))]
+        return cls(grid, landmarks, tables, costs)
@@ -1,29 +1,49 @@
 import astar
-from map import Map, MapElement, MapView
+from map import Map, MapElement, MapView, CameraGroup
 from astar import AStar
 from imagecache import ImageCache
-from maputils import getCost, getHeuristicCost, setCost, isImpassable
-from random import random, randint
+from maputils import getCost, getHeuristicCost, setCost
+from random import random, randint, seed as seedRandom
 from perlin import Perlin
+from chunkprefetcher import ChunkPrefetcher
+from chunksurfaces import ChunkSurfaceCache
+from collision import GridCollider, SpatialHash
+from mobswarm import MobSwarm
+from profiler import profiler
 
-import sys, pygame
+import os, sys, pygame
+from optparse import OptionParser
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 per = Perlin()
 
-def initMapElement(elem):
-    #val = per.perlin2d(elem.x, elem.y, 0.15, 4)
-    val = per.perlin2d(elem.x, elem.y, 40, 4)
-    if int(val * 4) == 0:
-        i = 'impassable-1'
-        t = 'impassable'    
-    else:
-        i = 'normal'
-        t = 'normal'
-        
-    elem.meta = {'image': i,
-                 'type': t}
+def initChunk(x0, y0, size):
+    #vals = per.perlin2dBlock(x0, y0, size, size, 0.15, 4)
+    vals = per.perlin2dBlock(x0, y0, size, size, 40, 4)
+    types = []
+    images = []
+    for row in vals:
+        for val in row:
+            if int(val * 4) == 0:
+                images.append('impassable-1')
+                types.append('impassable')
+            else:
+                images.append('normal')
+                types.append('normal')
+
+    return types, images, [1] * (size * size)
 
 class MapSprite (pygame.sprite.Sprite):
+    """
+    A sprite placed in world pixels: location and rect never change
+    when the view scrolls, a CameraGroup moves them onto the screen
+    when it draws them.
+    """
+
     def __init__(self):
         pygame.sprite.Sprite.__init__(self)
         self.location = [0, 0]
@@ -36,17 +56,12 @@ class MapSprite (pygame.sprite.Sprite):
         self.rect.top = self.location[1]
         self.location[0] = self.rect.left
         self.location[1] = self.rect.top
-        self.rect.move_ip(-self.mapView.offsetX, -self.mapView.offsetY)
 
     def setMapView(self, mapView):
         self.mapView = mapView
-        self.mapView.addChangeListener(self._mapViewChangeListener)
-
-    def _mapViewChangeListener(self, x, y):
-        raise NotImplementedError
 
 class PlayerSprite (pygame.sprite.Sprite):
-    def __init__(self, img, x, y, imageCache, mobs):
+    def __init__(self, img, x, y, imageCache, mobs, maxMobs = 20):
         pygame.sprite.Sprite.__init__(self)
         self.image = img
         self.rect = self.image.get_rect()
@@ -59,6 +74,18 @@ class PlayerSprite (pygame.sprite.Sprite):
         self.imageCache = imageCache
         self.mobs = mobs
         self.mobsQueue = []
+        self.maxMobs = maxMobs
+        self.collider = None
+        # mobs only; the player queries it and is never added itself
+        self.spatialHash = SpatialHash()
+
+    def worldRect(self):
+        return self.rect.move(self.mapView.offsetX, self.mapView.offsetY)
+
+    def collidingMobs(self):
+        if isinstance(self.mobs, MobSwarm):
+            return self.mobs.query(self.worldRect(), 0.8)
+        return self.spatialHash.query(self.worldRect(), 0.8)
 
     def update(self, *args):
         maxSpeed = 25
@@ -70,62 +97,51 @@ class PlayerSprite (pygame.sprite.Sprite):
             side = randint(0, 3)
 
             if side == 0:           # top
-                x = randint(0, 31)
-                mob = MobSprite(32 * x + self.mapView.offsetX,
-                                0 + self.mapView.offsetY,
-                                self.imageCache.getCachedSurface("mob"),
-                                random() * maxSpeed/2 + maxSpeed/2,
-                                self,
-                                self.mapView)
+                x, y = 32 * randint(0, 31), 0
             elif side == 1:           # bottom
-                x = randint(0, 31)
-                mob = MobSprite(32 * x + self.mapView.offsetX,
-                                32 * 32 + self.mapView.offsetY,
-                                self.imageCache.getCachedSurface("mob"),
-                                random() * maxSpeed/2 + maxSpeed/2,
-                                self,
-                                self.mapView)
+                x, y = 32 * randint(0, 31), 32 * 32
             elif side == 2:           # left
-                y = randint(0, 31)
-                mob = MobSprite(0 + self.mapView.offsetX,
-                                32 * y + self.mapView.offsetY,
-                                self.imageCache.getCachedSurface("mob"),
-                                random() * maxSpeed/2 + maxSpeed/2,
-                                self,
-                                self.mapView)
+                x, y = 0, 32 * randint(0, 31)
             elif side == 3:           # right
-                y = randint(0, 31)
-                mob = MobSprite(32 * 32 + self.mapView.offsetX,
-                                32 * y + self.mapView.offsetY,
-                                self.imageCache.getCachedSurface("mob"),
-                                random() * maxSpeed/2 + maxSpeed/2,
-                                self,
-                                self.mapView)
-
-            self.mobs.add(mob)
-            self.mobsQueue.append(mob)
-
-        if len(self.mobs) > 20:
+                x, y = 32 * 32, 32 * randint(0, 31)
+
+            self._spawnMob(x + self.mapView.offsetX,
+                           y + self.mapView.offsetY,
+                           random() * maxSpeed/2 + maxSpeed/2)
+
+        if len(self.mobs) > self.maxMobs:
+            if not isinstance(self.mobs, MobSwarm):
+                for mob in self.mobs:
+                    self.spatialHash.remove(mob)
             self.mobs.empty()
 
+    def _spawnMob(self, x, y, speed):
+        if isinstance(self.mobs, MobSwarm):
+            self.mobs.spawn(x, y, speed)
+            return
+
+        mob = MobSprite(x, y,
+                        self.imageCache.getCachedSurface("mob"),
+                        speed,
+                        self,
+                        self.mapView,
+                        self.collider,
+                        self.spatialHash)
+        self.mobs.add(mob)
+        self.mobsQueue.append(mob)
+
 class ActorSprite (MapSprite):
-    def __init__(self, x, y, img, dx, dy):
+    def __init__(self, x, y, img):
         MapSprite.__init__(self)
         self.image = img
         self.rect = self.image.get_rect()
         self.location = [x, y]
         self.rect.left = self.location[0]
         self.rect.top = self.location[1]
-        self.rect.move_ip(-dx, -dy)
-    
-    def _mapViewChangeListener(self, x, y):
-        self.rect.left = self.location[0]
-        self.rect.top = self.location[1]
-        self.rect.move_ip(-x, -y)
 
 class MobSprite (ActorSprite):
-    def __init__(self, x, y, img, speed, player, mapView):
-        ActorSprite.__init__(self, x, y, img, 0, 0)
+    def __init__(self, x, y, img, speed, player, mapView, collider, spatialHash = None):
+        ActorSprite.__init__(self, x, y, img)
         self.dx = 0
         self.dy = 0
         self.dir = randint(0, 3)
@@ -133,8 +149,15 @@ class MobSprite (ActorSprite):
         self.speed = speed
         self.player = player
         self.mapView = mapView
+        self.collider = collider
+        self.spatialHash = spatialHash
 
         self.setMapView(mapView)
+        if spatialHash is not None:
+            spatialHash.update(self, self.worldRect())
+
+    def worldRect(self):
+        return self.rect
 
     def update(self, *args):
         if self.dir == 0:
@@ -150,22 +173,18 @@ class MobSprite (ActorSprite):
             self.dy = -self.speed
             self.dx = 0
 
-        if self.dy != 0:
-            for sprite in self.mapView:
-                if self.collideFunc(self, sprite) and isImpassable(sprite.mapElement):
-                    self._modifyLocation(0, -self.dy)
-                    self.dir = randint(0, 3)
-        if self.dx != 0:
-            for sprite in self.mapView:
-                if self.collideFunc(self, sprite) and isImpassable(sprite.mapElement):
-                    self._modifyLocation(0, -self.dx)
-                    self.dir = randint(0, 3)
-        
+        # back off whatever impassable terrain we ran into last step
+        if self.collider.collides(self.worldRect(), 0.6):
+            self._modifyLocation(-self.dx, -self.dy)
+            self.dir = randint(0, 3)
+
         self._modifyLocation(self.dx, self.dy)
+        if self.spatialHash is not None:
+            self.spatialHash.update(self, self.worldRect())
             
 class MineSprite (ActorSprite):
-    def __init__(self, x, y, img, dx, dy):
-        ActorSprite.__init__(self, x, y, img, dx, dy)
+    def __init__(self, x, y, img):
+        ActorSprite.__init__(self, x, y, img)
         self.collideFunc = pygame.sprite.collide_rect_ratio(0.8)
 
     def update(self, *args):
@@ -173,11 +192,43 @@ class MineSprite (ActorSprite):
 
 
 class GameLoop (object):
-    def __init__(self, ticks_per_second, max_frame_skip):
+    # 'full' blits every tile sprite, 'chunks' blits baked terrain
+    # surfaces and 'dirty' does the same but, while the view is still,
+    # only repaints and updates the areas sprites moved over
+    RENDER_MODES = ('full', 'chunks', 'dirty')
+
+    # mobs as one MobSprite each or as the arrays of a MobSwarm
+    MOB_BACKENDS = ('sprites', 'arrays')
+
+    # what update and render time is split into
+    SUBSYSTEMS = ('input', 'view', 'mobs', 'collisions', 'render')
+
+    def __init__(self, ticks_per_second, max_frame_skip, render_mode = 'chunks',
+                 mob_backend = 'sprites', max_mobs = 20, headless = False, seed = None,
+                 trace_path = None, atlas = False):
         self.TicksPerSecond = ticks_per_second
         self.TimePerTick = 1000.0 / self.TicksPerSecond # MS per tick
         self.MaxFrameSkip = max_frame_skip
-        
+        self.renderMode = render_mode
+        self.mobBackend = mob_backend
+        self._lastRenderOffset = None
+        self._overlayRect = None
+        self.playerHits = []
+
+        # F2 toggles the profiler overlay; with trace_path every scope is
+        # also traced and written there on quit
+        self.profiler = profiler
+        self.tracePath = trace_path
+        if trace_path is not None:
+            profiler.enable(tracing = True)
+
+        if seed is not None:
+            self.seed(seed)
+        if headless:
+            # SDL's dummy driver hands out a screen surface without
+            # opening a window
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
         pygame.init()
 
         try:
@@ -195,39 +246,120 @@ class GameLoop (object):
         self.screen = pygame.display.set_mode(size)
 
         self.imageCache = ImageCache()
+        self.imageCache.preload(('terrains', 'units'))
         self.imageCache.getSurface("units/Player1.png", "ball")
         self.imageCache.getSurface("units/Creature1.png", "mob")
         self.imageCache.getSurface("units/Mine1.png", "mine")
         self.imageCache.getSurface("terrains/Normal.jpg", "normal")
         self.imageCache.getSurface("terrains/Impassable5.jpg", "impassable-1")
+        if atlas:
+            self.imageCache.buildAtlas()
 
         ball = self.imageCache.getCachedSurface("ball")
-        self.mobs = pygame.sprite.Group()
-        self.playerSprite = PlayerSprite(ball, width/2-16, height/2-16, self.imageCache, self.mobs)
-        self.playerSpriteGroup = pygame.sprite.Group(self.playerSprite)
+        self.mobs = CameraGroup(None)
+        self.playerSprite = PlayerSprite(ball, width/2-16, height/2-16, self.imageCache, self.mobs, max_mobs)
+        self.playerSpriteGroup = pygame.sprite.RenderUpdates(self.playerSprite)
         self.mapView = None
+        self.terrain = None
 
     def _updateFPS(self, fps):
-        self.fontSurf = self.font.render('FPS: %.3f' % fps, True, (0, 255, 0))
+        lines = ['FPS: %.3f' % fps]
+        if self.profiler.enabled:
+            lines.append('%-10s %7s %7s %7s' % ('ms', 'p50', 'p95', 'p99'))
+            for name, values in self.profiler.summary():
+                lines.append('%-10s %7.2f %7.2f %7.2f' % ((name,) + tuple([v * 1000 for v in values])))
+
+        rendered = [self.font.render(line, True, (0, 255, 0)) for line in lines]
+        lineHeight = self.font.get_linesize()
+        self.fontSurf = pygame.Surface((max([r.get_width() for r in rendered]), lineHeight * len(rendered)),
+                                       pygame.SRCALPHA)
+        for i, r in enumerate(rendered):
+            self.fontSurf.blit(r, (0, i * lineHeight))
+
+    def _showOverlay(self):
+        return self.fontSurf and (self._displayFPS or self.profiler.enabled)
 
     def render(self):
-        self.screen.fill(self.black)
-        self.mapView.draw(self.screen)
+        with self.profiler.scope('render'):
+            self._renderFrame()
+
+    def _renderFrame(self):
+        if self.renderMode == 'full':
+            self.screen.fill(self.black)
+            self.mapView.draw(self.screen)
+        elif self.renderMode == 'dirty':
+            offset = (self.mapView.offsetX, self.mapView.offsetY)
+            if offset == self._lastRenderOffset:
+                self._renderDirty()
+                return
+            self._lastRenderOffset = offset
+            self.terrain.draw(self.screen, *offset)
+        else:
+            self.terrain.draw(self.screen, self.mapView.offsetX, self.mapView.offsetY)
+
         self.playerSpriteGroup.draw(self.screen)
         self.mobs.draw(self.screen)
-        if self.fontSurf and self._displayFPS:
-            self.screen.blit(self.fontSurf, (25, 25))
+        self._overlayRect = None
+        if self._showOverlay():
+            self._overlayRect = self.screen.blit(self.fontSurf, (25, 25))
         pygame.display.flip()
 
-    def update(self):
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: sys.exit()
+    def _clearTerrain(self, surface, rect):
+        self.terrain.draw(surface, self.mapView.offsetX, self.mapView.offsetY, rect)
+
+    def _renderDirty(self):
+        # the view has not moved, so only what sprites covered last
+        # frame and cover now needs repainting
+        self.playerSpriteGroup.clear(self.screen, self._clearTerrain)
+        self.mobs.clear(self.screen, self._clearTerrain)
+        dirty = []
+        if self._overlayRect:
+            self._clearTerrain(self.screen, self._overlayRect)
+            dirty.append(self._overlayRect)
+            self._overlayRect = None
+
+        dirty.extend(self.playerSpriteGroup.draw(self.screen))
+        dirty.extend(self.mobs.draw(self.screen))
+        if self._showOverlay():
+            self._overlayRect = self.screen.blit(self.fontSurf, (25, 25))
+            dirty.append(self._overlayRect)
+        pygame.display.update(dirty)
+
+    def seed(self, seed):
+        global per
+        per = Perlin(seed)
+        seedRandom(seed)
+        if numpy is not None:
+            numpy.random.seed(seed)
+
+    def update(self, events = None):
+        scope = self.profiler.scope
+        with scope('input'):
+            if events is None:
+                events = pygame.event.get()
+            self.handleEvents(events)
+        with scope('view'):
+            self.mapView.update()
+            self.playerSpriteGroup.update()
+        with scope('mobs'):
+            self.mobs.update()
+        with scope('collisions'):
+            self.playerHits = self.playerSprite.collidingMobs()
+
+    def quit(self):
+        if self.tracePath is not None:
+            self.profiler.dumpTrace(self.tracePath)
+        sys.exit()
+
+    def handleEvents(self, events):
+        for event in events:
+            if event.type == pygame.QUIT: self.quit()
             
             speed = 15
 
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
-                    sys.exit()
+                    self.quit()
                 elif event.key == pygame.K_a:
                     self.playerSprite.dx -= speed
                 elif event.key == pygame.K_d:
@@ -238,6 +370,11 @@ class GameLoop (object):
                     self.playerSprite.dy += speed
                 elif event.key == pygame.K_F1:
                     self._displayFPS = not self._displayFPS
+                elif event.key == pygame.K_F2:
+                    if self.profiler.enabled:
+                        self.profiler.disable()
+                    else:
+                        self.profiler.enable(tracing = self.tracePath is not None)
                     
             if event.type == pygame.KEYUP:
                 if event.key == pygame.K_a:
@@ -249,9 +386,47 @@ class GameLoop (object):
                 elif event.key == pygame.K_s:
                     self.playerSprite.dy -= speed
 
-        self.mapView.update()
-        self.playerSpriteGroup.update()
-        self.mobs.update()
+    def initLevel(self):
+        self.levelMap = Map(chunkCB = initChunk)
+        self.mapView = MapView(self.levelMap, self.imageCache, pygame.Rect(0, 0, 800, 600), 32, 32)
+        self.playerSprite.mapView = self.mapView
+        self.playerSprite.collider = GridCollider(self.levelMap, 32, 32)
+        self.mobs.camera = self.mapView
+        if self.mobBackend == 'arrays':
+            self.mobs = MobSwarm(self.levelMap, self.mapView, self.imageCache.getCachedSurface("mob"), 32, 32)
+            self.playerSprite.mobs = self.mobs
+        self.prefetcher = ChunkPrefetcher(self.levelMap.store, self.mapView)
+        self.terrain = ChunkSurfaceCache(self.levelMap, self.imageCache, 32, 32)
+        self.levelMap.addChangeListener(self._mapChangeListener)
+
+    def _mapChangeListener(self, x, y):
+        # an edited tile is only picked up by a full repaint
+        self._lastRenderOffset = None
+
+    def simulate(self, ticks, script = None, render = True):
+        """
+        Runs ticks updates back to back, each followed by a render,
+        without waiting on the clock. script maps a tick number to the
+        events fed to that tick in place of the event queue. Returns
+        the seconds spent in each subsystem, as timed by the profiler.
+        """
+        if self.mapView is None:
+            self.initLevel()
+        if script is None:
+            script = {}
+
+        profiler = self.profiler
+        wasEnabled = profiler.enabled
+        if not wasEnabled:
+            profiler.enable()
+        profiler.reset()
+        for tick in range(ticks):
+            self.update(script.get(tick, []))
+            if render:
+                self.render()
+        if not wasEnabled:
+            profiler.disable()
+        return dict([(name, profiler.total(name)) for name in self.SUBSYSTEMS])
 
     def loop(self):
         nextGameTick = pygame.time.get_ticks()
@@ -259,9 +434,7 @@ class GameLoop (object):
         renderClock = pygame.time.Clock()
         updateTick = 0
 
-        self.levelMap = Map(mapElementCB = initMapElement)
-        self.mapView = MapView(self.levelMap, self.imageCache, pygame.Rect(0, 0, 800, 600), 32, 32)
-        self.playerSprite.mapView = self.mapView
+        self.initLevel()
 
         while 1:
             loops = 0
@@ -279,5 +452,18 @@ class GameLoop (object):
             self.render()
 
 if __name__ == '__main__':
-    game = GameLoop(10, 5)
+    parser = OptionParser()
+    parser.add_option('--trace', metavar = 'FILE', help = 'trace every profiler scope to FILE on quit')
+    parser.add_option('--render-mode', dest = 'renderMode', type = 'choice',
+                      choices = GameLoop.RENDER_MODES, default = 'chunks',
+                      help = ', '.join(GameLoop.RENDER_MODES))
+    parser.add_option('--mobs', type = 'choice', choices = GameLoop.MOB_BACKENDS, default = 'sprites',
+                      help = ', '.join(GameLoop.MOB_BACKENDS))
+    parser.add_option('--seed', type = 'int', help = 'seed the terrain and mobs')
+    options, args = parser.parse_args()
+    if args:
+        parser.error('unexpected arguments: %s' % ' '.join(args))
+
+    game = GameLoop(10, 5, render_mode = options.renderMode, mob_backend = options.mobs,
+                    seed = options.seed, trace_path = options.trace)
     game.loop()
@@ -1,4 +1,8 @@
-from pygame.sprite import Sprite, Group, Rect
+from collections import OrderedDict
+
+from pygame.sprite import Sprite, Group, RenderUpdates, Rect
+
+from chunkstore import ChunkStore
 
 class MapElement (object):
     def __init__(self, x, y, mapElementCB = None):
@@ -11,16 +15,85 @@ class MapElement (object):
     def __eq__(self, elem):
         return self.x == elem.x and self.y == elem.y
 
+    def __ne__(self, elem):
+        return not self.__eq__(elem)
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
     def __repr__(self):
         return '(%d, %d)' % (self.x, self.y)
         
 class Map (object):
-    def __init__(self, mapElementCB = None):
+    """
+    Tiles live in a ChunkStore and are generated a chunk at a time,
+    either by chunkCB(x0, y0, size) returning type names, image names
+    and costs for the chunk, or by running mapElementCB on a
+    MapElement for every tile in it.
+    """
+
+    def __init__(self, mapElementCB = None, width = None, height = None, chunkCB = None,
+                 chunkSize = 32, maxBytes = 64 << 20, directory = None):
         self.meta = {}
         self.mapElementCB = mapElementCB
+        self.width = width
+        self.height = height
+        self._changeListeners = []
+        self.store = ChunkStore(chunkCB or self._generateChunk, chunkSize, maxBytes, directory)
+
+    def _generateChunk(self, x0, y0, size):
+        types = []
+        images = []
+        costs = []
+        for y in range(y0, y0 + size):
+            for x in range(x0, x0 + size):
+                elem = MapElement(x, y, self.mapElementCB)
+                meta = getattr(elem, 'meta', {})
+                types.append(meta.get('type', 'normal'))
+                images.append(meta.get('image', 'normal'))
+                costs.append(meta.get('cost', 1))
+        return types, images, costs
+
+    def addChangeListener(self, listener):
+        self._changeListeners.append(listener)
+
+    def removeChangeListener(self, listener):
+        self._changeListeners.remove(listener)
+
+    def tileChanged(self, x, y):
+        for listener in self._changeListeners:
+            listener(x, y)
 
     def getMapElement(self, x, y):
-        return MapElement(x, y, self.mapElementCB)
+        store = self.store
+        chunk = store.chunkAt(x, y)
+        i = store.tileIndex(x, y)
+        elem = MapElement(x, y)
+        elem.meta = {'type': store.typeNames[chunk.types[i]],
+                     'image': store.imageNames[chunk.images[i]],
+                     'cost': chunk.costs[i]}
+        return elem
+
+    def getType(self, x, y):
+        return self.store.getType(x, y)
+
+    def getCost(self, x, y):
+        return self.store.getCost(x, y)
+
+    def getImage(self, x, y):
+        return self.store.getImage(x, y)
+
+    def setType(self, x, y, type):
+        self.store.setType(x, y, type)
+        self.tileChanged(x, y)
+
+    def setCost(self, x, y, cost):
+        self.store.setCost(x, y, cost)
+        self.tileChanged(x, y)
+
+    def setImage(self, x, y, image):
+        self.store.setImage(x, y, image)
+        self.tileChanged(x, y)
 
     def getDiagonalAdjacencies(self, elem):
         x = elem.x
@@ -62,8 +135,12 @@ class Map (object):
 class MapElementSprite (Sprite):
     def __init__(self, mapElement, imageCache):
         Sprite.__init__(self)
+        self.imageCache = imageCache
+        self.setMapElement(mapElement)
+
+    def setMapElement(self, mapElement):
         self.mapElement = mapElement
-        self.image = imageCache.getCachedSurface(self.mapElement.meta['image'])
+        self.image = self.imageCache.getCachedSurface(self.mapElement.meta['image'])
         self.rect = self.image.get_rect()
         pixelLocation = self.mapElement.meta['screenLocation']
         self.rect.move_ip(*pixelLocation)
@@ -82,6 +159,15 @@ class MapView (Group):
         self.imageSize = (imWidth, imHeight)
         self.offsetX = 0
         self.offsetY = 0
+
+        # visible tile sprites by (x, y), the tile range they cover as
+        # (minX, minY, maxX, maxY) and sprites free for reuse
+        self._tiles = {}
+        self._tileRange = None
+        self._lastOffset = None
+        self._spritePool = []
+
+        map.addChangeListener(self._mapChangeListener)
         self.setView(rectPixelView)
 
     def _updateView(self):
@@ -100,26 +186,113 @@ class MapView (Group):
         self._updateView()
 
     def _updateContainer(self):
-        self.empty()
-
-        sprites = []
         w = self.imageSize[0]
         h = self.imageSize[1]
-        for xi in range(self.numTiles[0] + 1):
-            x = xi + int(self.offsetX/32)
-            for yi in range(self.numTiles[1] + 2):
-                y = yi + int(self.offsetY/32)
-                elem = self.map.getMapElement(x, y)
-                elem.meta['screenLocation'] = elem.x * w - self.offsetX, elem.y * h - self.offsetY
-                sprites.append(MapElementSprite(elem, self.imageCache))
+        minX = int(self.offsetX/w)
+        minY = int(self.offsetY/h)
+        newRange = (minX, minY, minX + self.numTiles[0] + 1, minY + self.numTiles[1] + 2)
+
+        oldRange = self._tileRange
+        if oldRange is not None:
+            # everything already on screen just slides along
+            dx = self._lastOffset[0] - self.offsetX
+            dy = self._lastOffset[1] - self.offsetY
+            if dx or dy:
+                for sprite in self._tiles.itervalues():
+                    sprite.rect.move_ip(dx, dy)
+        self._lastOffset = (self.offsetX, self.offsetY)
+        self._tileRange = newRange
+
+        if newRange == oldRange:
+            return
+
+        # only the rows and columns that left or entered the view are
+        # touched
+        if oldRange is not None:
+            for key in self._rangeDifference(oldRange, newRange):
+                sprite = self._tiles.pop(key)
+                self.remove(sprite)
+                self._spritePool.append(sprite)
+
+        sprites = []
+        for x, y in self._rangeDifference(newRange, oldRange):
+            elem = self.map.getMapElement(x, y)
+            elem.meta['screenLocation'] = elem.x * w - self.offsetX, elem.y * h - self.offsetY
+            if self._spritePool:
+                sprite = self._spritePool.pop()
+                sprite.setMapElement(elem)
+            else:
+                sprite = MapElementSprite(elem, self.imageCache)
+            self._tiles[(x, y)] = sprite
+            sprites.append(sprite)
         self.add(sprites)
 
+    def _rangeDifference(self, a, b):
+        # tiles of range a that are not in range b
+        minX, minY, maxX, maxY = a
+        if b is None:
+            return [(x, y) for x in range(minX, maxX) for y in range(minY, maxY)]
+
+        results = []
+        for x in range(minX, maxX):
+            if x < b[0] or x >= b[2]:
+                results.extend([(x, y) for y in range(minY, maxY)])
+            else:
+                results.extend([(x, y) for y in range(minY, min(maxY, b[1]))])
+                results.extend([(x, y) for y in range(max(minY, b[3]), maxY)])
+        return results
+
+    def _mapChangeListener(self, x, y):
+        sprite = self._tiles.get((x, y))
+        if sprite is not None:
+            elem = self.map.getMapElement(x, y)
+            elem.meta['screenLocation'] = sprite.rect.topleft
+            sprite.setMapElement(elem)
+
     def addChangeListener(self, listener):
         self._changeListeners.append(listener)
 
+    def removeChangeListener(self, listener):
+        self._changeListeners.remove(listener)
+
     def _updateChangeListeners(self, *args):
         for listener in self._changeListeners:
             listener(*args)
 
+class CameraGroup (RenderUpdates):
+    """
+    Sprites whose rects are in world pixels, drawn through the offset
+    of the camera MapView. Scrolling touches none of them; the offset is
+    applied once per sprite when drawing, and the screen rects returned
+    and cleared are the ones they were drawn at.
+    """
+
+    def __init__(self, camera, *sprites):
+        RenderUpdates.__init__(self)
+        # sprites update in the order they were added, not in hash
+        # order, so runs with the same seed play out the same
+        self.spritedict = OrderedDict()
+        self.add(*sprites)
+        self.camera = camera
 
-                
+    def draw(self, surface):
+        offsetX = self.camera.offsetX
+        offsetY = self.camera.offsetY
+        spritedict = self.spritedict
+        blit = surface.blit
+        dirty = self.lostsprites
+        self.lostsprites = []
+        for sprite in self.sprites():
+            old = spritedict[sprite]
+            rect = sprite.rect
+            new = blit(sprite.image, (rect.left - offsetX, rect.top - offsetY))
+            if old:
+                if new.colliderect(old):
+                    dirty.append(new.union(old))
+                else:
+                    dirty.append(new)
+                    dirty.append(old)
+            else:
+                dirty.append(new)
+            spritedict[sprite] = new
+        return dirty
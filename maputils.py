@@ -1,7 +1,5 @@
 def getCost(map, elem):
-    x = elem.x
-    y = elem.y
-    return map.map[map.width * y + x].meta['cost']
+    return map.getCost(elem.x, elem.y)
 
 def getHeuristicCost(map, elem1, elem2):
     x1 = elem1.x
@@ -11,7 +9,13 @@ def getHeuristicCost(map, elem1, elem2):
     return (abs(x2 - x1) + abs(y2 - y1)) * map.meta['averageCost']
 
 def setCost(map, x, y, cost):
-    map.map[map.width * y + x].meta['cost'] = cost
+    map.setCost(x, y, cost)
+
+def setType(map, x, y, type):
+    map.setType(x, y, type)
 
 def isImpassable(elem):
     return elem.meta['type'] == 'impassable'
+
+def isImpassableAt(map, x, y):
+    return map.getType(x, y) == 'impassable'
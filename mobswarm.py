@@ -0,0 +1,220 @@
+from random import randint
+
+from pygame import Rect
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# per direction step, in the order MobSprite numbers them: right,
+# left, down, up
+DIRECTION_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+class MobSwarm (object):
+    """
+    Mobs kept as parallel NumPy arrays (position, direction and speed)
+    instead of one MobSprite each, so a tick moves and collides all of
+    them in a handful of array operations and drawing is one
+    Surface.blits call. Mobs behave like MobSprite: every tick a mob
+    standing on impassable terrain undoes its last step and picks a new
+    direction.
+
+    It stands in for the mob sprite group: update, draw, clear, empty
+    and len work the same way, with positions kept in world space and
+    mapView supplying the screen offset.
+    """
+
+    def __init__(self, map, mapView, image, tileWidth, tileHeight, ratio = 0.6, capacity = 1024):
+        if numpy is None:
+            raise ImportError('MobSwarm needs numpy')
+        self.map = map
+        self.mapView = mapView
+        self.image = image
+        self.tileSize = (tileWidth, tileHeight)
+        self.count = 0
+
+        self.x = numpy.zeros(capacity)
+        self.y = numpy.zeros(capacity)
+        self.dir = numpy.zeros(capacity, dtype = numpy.int8)
+        self.speed = numpy.zeros(capacity)
+
+        self._stepX = numpy.array([dx for dx, dy in DIRECTION_STEPS], dtype = float)
+        self._stepY = numpy.array([dy for dx, dy in DIRECTION_STEPS], dtype = float)
+
+        # the mob and tile rects collide_rect_ratio would compare, as
+        # offsets from the unscaled top left corner
+        w, h = image.get_size()
+        mob = Rect(0, 0, w, h).inflate(w * ratio - w, h * ratio - h)
+        tile = Rect(0, 0, tileWidth, tileHeight).inflate(tileWidth * ratio - tileWidth,
+                                                         tileHeight * ratio - tileHeight)
+        self._mobBox = (mob.left, mob.top, mob.width, mob.height)
+        self._tileBox = (tile.left, tile.top, tile.width, tile.height)
+
+        self._lastRects = []
+
+    def _grow(self, capacity):
+        for name in ('x', 'y', 'dir', 'speed'):
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, dtype = old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def spawn(self, x, y, speed, direction = None):
+        if self.count == len(self.x):
+            self._grow(2 * len(self.x))
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.speed[i] = speed
+        self.dir[i] = randint(0, 3) if direction is None else direction
+        self.count += 1
+        return i
+
+    def spawnMany(self, xs, ys, speeds, directions = None):
+        n = len(xs)
+        if self.count + n > len(self.x):
+            self._grow(max(2 * len(self.x), self.count + n))
+        s = slice(self.count, self.count + n)
+        self.x[s] = xs
+        self.y[s] = ys
+        self.speed[s] = speeds
+        if directions is None:
+            directions = numpy.random.randint(0, 4, n)
+        self.dir[s] = directions
+        self.count += n
+
+    def kill(self, indices):
+        """
+        Removes the mobs at indices; the last mobs move into the freed
+        slots, so indices held from before are no longer valid.
+        """
+        keep = numpy.ones(self.count, dtype = bool)
+        keep[indices] = False
+        n = int(keep.sum())
+        for name in ('x', 'y', 'dir', 'speed'):
+            values = getattr(self, name)
+            values[:n] = values[:self.count][keep]
+        self.count = n
+
+    def empty(self):
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def blocked(self, xs, ys):
+        """
+        Whether each mob whose unscaled top left corner is at (xs, ys)
+        overlaps impassable terrain.
+        """
+        tileW, tileH = self.tileSize
+        mobX, mobY, mobW, mobH = self._mobBox
+        tileX, tileY, tileBoxW, tileBoxH = self._tileBox
+
+        left = numpy.floor(xs).astype(int) + mobX
+        top = numpy.floor(ys).astype(int) + mobY
+        result = numpy.zeros(len(xs), dtype = bool)
+
+        # every tile the scaled mob can reach, one column/row offset at
+        # a time
+        spanX = (mobW + tileBoxW) // tileW + 1
+        spanY = (mobH + tileBoxH) // tileH + 1
+        firstX = (left - tileX - tileBoxW) // tileW + 1
+        firstY = (top - tileY - tileBoxH) // tileH + 1
+        for i in range(spanX):
+            cellX = firstX + i
+            overlapX = (left < cellX * tileW + tileX + tileBoxW) & (cellX * tileW + tileX < left + mobW)
+            for j in range(spanY):
+                cellY = firstY + j
+                overlap = overlapX & (top < cellY * tileH + tileY + tileBoxH) & (cellY * tileH + tileY < top + mobH)
+                if overlap.any():
+                    hit = numpy.flatnonzero(overlap)
+                    result[hit] |= self._blockedCells(cellX[hit], cellY[hit])
+        return result
+
+    def _blockedCells(self, cellX, cellY):
+        m = self.map
+        store = m.store
+        size = store.chunkSize
+        impassable = store.typeId('impassable')
+
+        result = numpy.zeros(len(cellX), dtype = bool)
+        chunks = numpy.stack([cellX // size, cellY // size], 1)
+        keys, which = numpy.unique(chunks, axis = 0, return_inverse = True)
+        local = (cellY % size) * size + cellX % size
+        for k, (cx, cy) in enumerate(keys):
+            types = numpy.frombuffer(store.getChunk(int(cx), int(cy)).types, dtype = numpy.uint8)
+            inChunk = which == k
+            result[inChunk] = types[local[inChunk]] == impassable
+
+        if m.width is not None:
+            result |= (cellX < 0) | (cellX >= m.width)
+        if m.height is not None:
+            result |= (cellY < 0) | (cellY >= m.height)
+        return result
+
+    def update(self, *args):
+        n = self.count
+        if not n:
+            return
+        x = self.x[:n]
+        y = self.y[:n]
+        dirs = self.dir[:n]
+        dx = self._stepX[dirs] * self.speed[:n]
+        dy = self._stepY[dirs] * self.speed[:n]
+
+        # a mob that ended its last step on impassable terrain takes it
+        # back and turns; like MobSprite it still moves this tick's
+        # step in its old direction, so it ends up where it was
+        hit = self.blocked(x, y)
+        if hit.any():
+            dx[hit] = 0
+            dy[hit] = 0
+            dirs[hit] = numpy.random.randint(0, 4, int(hit.sum()))
+        x += dx
+        y += dy
+
+    def query(self, rect, ratio = 1.0):
+        """
+        Indices of the mobs whose rect overlaps the world space rect,
+        both scaled by ratio.
+        """
+        n = self.count
+        w, h = self.image.get_size()
+        mob = Rect(0, 0, w, h).inflate(w * ratio - w, h * ratio - h)
+        rect = Rect(rect)
+        rect = rect.inflate(rect.width * ratio - rect.width, rect.height * ratio - rect.height)
+        left = numpy.floor(self.x[:n]).astype(int) + mob.left
+        top = numpy.floor(self.y[:n]).astype(int) + mob.top
+        return numpy.flatnonzero((left < rect.right) & (rect.left < left + mob.width) &
+                                 (top < rect.bottom) & (rect.top < top + mob.height))
+
+    def _visible(self, surface):
+        n = self.count
+        w, h = self.image.get_size()
+        screenW, screenH = surface.get_size()
+        x = numpy.floor(self.x[:n]).astype(int) - self.mapView.offsetX
+        y = numpy.floor(self.y[:n]).astype(int) - self.mapView.offsetY
+        onScreen = (x > -w) & (x < screenW) & (y > -h) & (y < screenH)
+        return x[onScreen], y[onScreen]
+
+    def draw(self, surface):
+        """
+        Blits every mob on screen and, like RenderUpdates.draw, returns
+        the areas that changed: where mobs were drawn last time and
+        where they are now.
+        """
+        x, y = self._visible(surface)
+        image = self.image
+        rects = surface.blits([(image, pos) for pos in zip(x.tolist(), y.tolist())])
+        dirty = self._lastRects + rects
+        self._lastRects = rects
+        return dirty
+
+    def clear(self, surface, background):
+        for rect in self._lastRects:
+            if callable(background):
+                background(surface, rect)
+            else:
+                surface.blit(background, rect, rect)
@@ -0,0 +1,297 @@
+import sys, time, random
+from array import array
+
+from map import Map
+from astar import AStar, SearchStats
+from gridastar import GridAStar
+from connectivity import ConnectivityIndex
+from dstarlite import DStarLite
+from flowfield import FlowField
+from landmarks import LandmarkHeuristic
+from pathworkers import PathWorkerPool
+from maputils import getCost, getHeuristicCost, isImpassable, isImpassableAt
+from perlin import Perlin
+from priorityqueueset import PriorityQueueSet, HeapPriorityQueueSet
+
+def makePerlinMap(size, freq = 40, seed = 0, threshold = 0.25):
+    per = Perlin(seed)
+
+    def initMapElement(elem):
+        val = per.perlin2d(elem.x, elem.y, freq, 4)
+        if val < threshold:
+            t = 'impassable'
+        else:
+            t = 'normal'
+        elem.meta = {'image': t,
+                     'type': t,
+                     'cost': 1}
+
+    m = Map(mapElementCB = initMapElement, width = size, height = size)
+    m.meta['averageCost'] = 1
+    return m
+
+def findEndpoints(m):
+    # the first passable tile walking in from opposite corners
+    start = goal = None
+    last = m.width * m.height - 1
+    for i in range(m.width * m.height):
+        if start is None and not isImpassableAt(m, i % m.width, i // m.width):
+            start = m.getMapElement(i % m.width, i // m.width)
+        if goal is None and not isImpassableAt(m, (last - i) % m.width, (last - i) // m.width):
+            goal = m.getMapElement((last - i) % m.width, (last - i) // m.width)
+    return start, goal
+
+def makeAStar(m, queueFactory = HeapPriorityQueueSet, connectivity = None):
+    return AStar(m.getDiagonalAdjacencies,
+                 lambda elem: getCost(m, elem),
+                 lambda elem1, elem2: getHeuristicCost(m, elem1, elem2),
+                 isImpassable,
+                 queueFactory = queueFactory,
+                 connectivity = connectivity)
+
+def timeIt(func, repeat = 3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def benchQueues(sizes = (16, 32, 64, 128, 256)):
+    queues = [('dict', PriorityQueueSet), ('heap', HeapPriorityQueueSet)]
+
+    print '%6s %8s %9s %12s %12s' % ('size', 'length', 'expanded', 'dict (ms)', 'heap (ms)')
+    for size in sizes:
+        m = makePerlinMap(size)
+        start, goal = findEndpoints(m)
+        stats = SearchStats()
+        times = []
+        for name, queueFactory in queues:
+            astar = makeAStar(m, queueFactory)
+            elapsed, path = timeIt(lambda: astar.best_path(start, goal, stats))
+            times.append(elapsed * 1000)
+        print '%6d %8d %9d %12.2f %12.2f' % (size, len(path), stats.nodesExpanded,
+                                             times[0], times[1])
+
+def benchJPS(sizes = (64, 128, 256)):
+    # open: scattered single-tile obstacles, maze: low frequency noise
+    # giving large walled blobs
+    kinds = [('open', 40, 0.1), ('maze', 0.3, 0.35)]
+
+    print '%5s %6s %8s %12s %12s %12s %9s %9s' % ('kind', 'size', 'length', 'AStar (ms)',
+                                                 'grid (ms)', 'jps (ms)', 'grid exp', 'jps exp')
+    for kind, freq, threshold in kinds:
+        for size in sizes:
+            m = makePerlinMap(size, freq, threshold = threshold)
+            start, goal = findEndpoints(m)
+            astar = makeAStar(m)
+            grid = GridAStar.fromMap(m)
+            posA = (start.x, start.y)
+            posB = (goal.x, goal.y)
+            gridStats = SearchStats()
+            jpsStats = SearchStats()
+
+            astarTime, path = timeIt(lambda: astar.best_path(start, goal))
+            gridTime, path = timeIt(lambda: grid.best_path(posA, posB, gridStats))
+            jpsTime, path = timeIt(lambda: grid.best_path(posA, posB, jpsStats, 'jps'))
+            print '%5s %6d %8d %12.2f %12.2f %12.2f %9d %9d' % (
+                kind, size, len(path), astarTime * 1000, gridTime * 1000, jpsTime * 1000,
+                gridStats.nodesExpanded, jpsStats.nodesExpanded)
+
+def randomQueries(grid, count, seed = 0):
+    rand = random.Random(seed)
+    tiles = [i for i in range(grid.width * grid.height) if grid.passable[i]]
+    queries = []
+    for i in range(count):
+        a = rand.choice(tiles)
+        b = rand.choice(tiles)
+        queries.append(((a % grid.width, a // grid.width), (b % grid.width, b // grid.width)))
+    return queries
+
+def benchWorkers(size = 128, count = 200, workerCounts = (1, 2, 4, 8)):
+    grid = GridAStar.fromMap(makePerlinMap(size, 0.3, threshold = 0.35))
+    queries = randomQueries(grid, count)
+
+    start = time.time()
+    for posA, posB in queries:
+        grid.best_path(posA, posB)
+    inline = count / (time.time() - start)
+
+    print '%8s %14s' % ('workers', 'paths/second')
+    print '%8s %14.1f' % ('inline', inline)
+    for numWorkers in workerCounts:
+        pool = PathWorkerPool(grid, numWorkers)
+        # let every worker start up before timing
+        for future in [pool.submit(posA, posB) for posA, posB in queries[:numWorkers]]:
+            future.result()
+        start = time.time()
+        futures = [pool.submit(posA, posB) for posA, posB in queries]
+        for future in futures:
+            future.result()
+        print '%8d %14.1f' % (numWorkers, count / (time.time() - start))
+        pool.close()
+
+def benchUnreachable(sizes = (64, 128, 256)):
+    # the goal sits in a walled off box in the middle of the map, so
+    # a plain search floods everything reachable from the start first
+    print '%6s %12s %12s %12s %12s %12s' % ('size', 'astar (ms)', '+index (ms)',
+                                             'grid (ms)', '+index (ms)', 'build (ms)')
+    for size in sizes:
+        m = makePerlinMap(size)
+        mid = size // 2
+        for i in range(-3, 4):
+            for x, y in ((mid + i, mid - 3), (mid + i, mid + 3), (mid - 3, mid + i), (mid + 3, mid + i)):
+                m.setType(x, y, 'impassable')
+        m.setType(mid, mid, 'normal')
+        start, goal = findEndpoints(m)
+        goal = m.getMapElement(mid, mid)
+
+        buildTime, index = timeIt(lambda: ConnectivityIndex.fromMap(m), 1)
+        astarTime, path = timeIt(lambda: makeAStar(m).best_path(start, goal), 1)
+        indexedTime, path = timeIt(lambda: makeAStar(m, connectivity = index).best_path(start, goal))
+
+        grid = GridAStar.fromMap(m)
+        a = start.y * size + start.x
+        b = goal.y * size + goal.x
+        gridTime, path = timeIt(lambda: grid.best_path_ids(a, b))
+        ConnectivityIndex.fromGrid(grid)
+        gridIndexedTime, path = timeIt(lambda: grid.best_path_ids(a, b))
+
+        print '%6d %12.3f %12.3f %12.3f %12.3f %12.3f' % (size, astarTime * 1000, indexedTime * 1000,
+                                                          gridTime * 1000, gridIndexedTime * 1000,
+                                                          buildTime * 1000)
+
+def chebyshev(elem1, elem2):
+    return max(abs(elem1.x - elem2.x), abs(elem1.y - elem2.y))
+
+def benchReplan(size = 128, steps = 200, edits = 2, seed = 0):
+    # a mob walking its path toward a goal that wanders a tile at a
+    # time while the terrain gets a few edits per step
+    rand = random.Random(seed)
+    m = makePerlinMap(size)
+    start, goal = findEndpoints(m)
+
+    astar = AStar(m.getDiagonalAdjacencies, lambda elem: getCost(m, elem), chebyshev, isImpassable)
+    planner = DStarLite.fromMap(m, chebyshev)
+
+    astarTime = plannerTime = 0.0
+    astarExpanded = plannerExpanded = 0
+    stats = SearchStats()
+    for step in range(steps):
+        for i in range(edits):
+            x = rand.randrange(size)
+            y = rand.randrange(size)
+            if (x, y) != (start.x, start.y) and (x, y) != (goal.x, goal.y):
+                m.setCost(x, y, rand.choice((1, 2, 3)))
+        moves = [elem for elem in m.getDiagonalAdjacencies(goal) if not isImpassable(elem)]
+        if moves:
+            goal = rand.choice(moves)
+
+        t = time.time()
+        path = planner.best_path(start, goal, stats)
+        plannerTime += time.time() - t
+        plannerExpanded += stats.nodesExpanded
+
+        t = time.time()
+        expected = astar.best_path(start, goal, stats)
+        astarTime += time.time() - t
+        astarExpanded += stats.nodesExpanded
+
+        # the planner has to stay as good as a search from scratch
+        pathCost = sum([getCost(m, elem) for elem in path])
+        expectedCost = sum([getCost(m, elem) for elem in expected])
+        if abs(pathCost - expectedCost) > 1e-9:
+            raise RuntimeError('step %d: replanned path from %s to %s costs %s, A* found %s' %
+                               (step, start, goal, pathCost, expectedCost))
+
+        if len(path) > 1:
+            start = path[1]
+
+    print '%10s %12s %14s' % ('planner', 'ms/replan', 'expanded/replan')
+    print '%10s %12.3f %14.1f' % ('astar', astarTime / steps * 1000, float(astarExpanded) / steps)
+    print '%10s %12.3f %14.1f' % ('dstarlite', plannerTime / steps * 1000, float(plannerExpanded) / steps)
+    print 'restarts: %d' % planner.restarts
+
+def makeSerpentineGrid(size):
+    # walls every other row with the gap alternating between the ends,
+    # so a path from the top row to the bottom one winds through them all
+    costs = array('d', [1]) * (size * size)
+    passable = bytearray([1]) * (size * size)
+    for y in range(1, size, 2):
+        gap = size - 1 if (y // 2) % 2 == 0 else 0
+        for x in range(size):
+            if x != gap:
+                passable[y * size + x] = 0
+    return GridAStar(size, size, costs, passable)
+
+def benchFlowField(sizes = (128, 256)):
+    # a full rebuild on open terrain and in a maze, whose longest
+    # shortest path is about half the tiles
+    print '%10s %6s %12s' % ('kind', 'size', 'build (ms)')
+    for size in sizes:
+        for kind, grid in (('open', GridAStar.fromMap(makePerlinMap(size, 40, threshold = 0.1))),
+                           ('serpentine', makeSerpentineGrid(size))):
+            elapsed, field = timeIt(lambda: FlowField(grid, (0, 0)))
+            print '%10s %6d %12.2f' % (kind, size, elapsed * 1000)
+
+def makeWeightedMap(size, seed = 0):
+    # open terrain with patches costing 1 to 4 to cross
+    m = makePerlinMap(size, 0.3, seed, threshold = 0.35)
+    per = Perlin(seed + 1)
+    total = 0
+    for y in range(size):
+        for x in range(size):
+            cost = 1 + int(max(0, per.perlin2d(x, y, 20, 2)) * 6) % 4
+            m.setCost(x, y, cost)
+            total += cost
+    m.meta['averageCost'] = float(total) / (size * size)
+    return m
+
+def benchLandmarks(sizes = (64, 128), count = 100, landmarkCount = 8):
+    print '%6s %10s %12s %14s %10s' % ('size', 'heuristic', 'ms/query', 'expanded/query', 'cost')
+    for size in sizes:
+        m = makeWeightedMap(size)
+        buildTime, landmarks = timeIt(lambda: LandmarkHeuristic.fromMap(m, landmarkCount), 1)
+        grid = landmarks.grid
+        minCost = grid.minCost()
+        heuristics = [('distance', lambda elem1, elem2: getHeuristicCost(m, elem1, elem2)),
+                      ('chebyshev', lambda elem1, elem2: chebyshev(elem1, elem2) * minCost),
+                      ('alt', landmarks.heuristic)]
+        queries = [(m.getMapElement(*posA), m.getMapElement(*posB))
+                   for posA, posB in randomQueries(grid, count)]
+
+        optimal = None
+        for name, heuristic in heuristics:
+            astar = AStar(m.getDiagonalAdjacencies, lambda elem: getCost(m, elem), heuristic, isImpassable)
+            stats = SearchStats()
+            elapsed = 0.0
+            expanded = 0
+            costs = []
+            for start, goal in queries:
+                t = time.time()
+                path = astar.best_path(start, goal, stats)
+                elapsed += time.time() - t
+                expanded += stats.nodesExpanded
+                costs.append(sum([getCost(m, elem) for elem in path]))
+            if name == 'chebyshev':
+                optimal = costs
+            print '%6d %10s %12.3f %14.1f %10.1f' % (size, name, elapsed / count * 1000,
+                                                     float(expanded) / count, sum(costs))
+        print 'optimal cost %.1f, %d landmarks built in %.1f ms' % (sum(optimal), landmarkCount,
+                                                                  buildTime * 1000)
+
+benchmarks = {'queues': benchQueues,
+              'jps': benchJPS,
+              'workers': benchWorkers,
+              'unreachable': benchUnreachable,
+              'replan': benchReplan,
+              'landmarks': benchLandmarks,
+              'flowfield': benchFlowField}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(benchmarks.keys())
+    for name in names:
+        print '== %s ==' % name
+        benchmarks[name]()
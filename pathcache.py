@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+from astar import SearchStats
+
+class PathCache (object):
+    """
+    LRU cache in front of one AStar per adjacency mode, e.g.
+    {'diagonal': ..., 'square': ...}. Entries are keyed by (start,
+    goal, mode) and remember every tile their search looked at, so an
+    edit reported through the map's change listeners drops exactly the
+    entries it could affect.
+
+    Searches the connectivity index turned down are not cached: any
+    wall opening anywhere could join their ends.
+
+    Memory is bounded both by the number of entries and by the total
+    number of remembered tiles.
+    """
+
+    def __init__(self, map, searches, maxEntries = 256, maxTiles = 1 << 20):
+        self.searches = searches
+        self.maxEntries = maxEntries
+        self.maxTiles = maxTiles
+
+        # key -> (path, tiles)
+        self.entries = OrderedDict()
+        # (x, y) -> set of keys whose search touched that tile
+        self.tileIndex = {}
+        self.tileCount = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        map.addChangeListener(self._mapChangeListener)
+
+    def best_path(self, posA, posB, mode = 'diagonal'):
+        key = (posA.x, posA.y, posB.x, posB.y, mode)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self.entries[key] = entry
+            return list(entry[0])
+
+        self.misses += 1
+        stats = SearchStats(trackExplored = True)
+        path = self.searches[mode].best_path(posA, posB, stats)
+        if stats.disconnected:
+            return path
+        tiles = [(elem.x, elem.y) for elem in stats.explored]
+
+        self.entries[key] = (path, tiles)
+        self.tileCount += len(tiles)
+        for tile in tiles:
+            self.tileIndex.setdefault(tile, set()).add(key)
+
+        while len(self.entries) > 1 and (len(self.entries) > self.maxEntries or
+                                         self.tileCount > self.maxTiles):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+        return list(path)
+
+    def _remove(self, key):
+        path, tiles = self.entries.pop(key)
+        self.tileCount -= len(tiles)
+        for tile in tiles:
+            keys = self.tileIndex[tile]
+            keys.discard(key)
+            if not keys:
+                del self.tileIndex[tile]
+
+    def _mapChangeListener(self, x, y):
+        for key in list(self.tileIndex.get((x, y), ())):
+            self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.tileIndex.clear()
+        self.tileCount = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'entries: %d, hits: %d, misses: %d, evictions: %d, invalidations: %d' % (
+            len(self.entries), self.hits, self.misses, self.evictions, self.invalidations)
@@ -0,0 +1,90 @@
+import time
+from collections import deque
+
+class PathRequest (object):
+    def __init__(self, search, callback, tick):
+        self.search = search
+        self.callback = callback
+        self.requestTime = time.time()
+        self.requestTick = tick
+        self.latency = None
+        self.latencyTicks = None
+
+    @property
+    def done(self):
+        return self.search.done
+
+    @property
+    def path(self):
+        return self.search.path
+
+class PathScheduler (object):
+    """
+    Round-robins pending resumable searches (anything with AStarSearch's
+    advance/done/path) inside a per-tick millisecond budget, giving each
+    one sliceNodes expansions per turn. Latency is measured from
+    request to completion, in milliseconds and in ticks.
+    """
+
+    def __init__(self, budgetMillis = 2.0, sliceNodes = 32):
+        self.budgetMillis = budgetMillis
+        self.sliceNodes = sliceNodes
+        self.pending = deque()
+        self.ticks = 0
+
+        self.completed = 0
+        self.totalLatency = 0.0
+        self.maxLatency = 0.0
+        self.maxLatencyTicks = 0
+
+    def request(self, astar, posA, posB, callback = None, mode = 'astar'):
+        return self.add(astar.search(posA, posB, mode = mode), callback)
+
+    def add(self, search, callback = None):
+        request = PathRequest(search, callback, self.ticks)
+        if search.done:
+            self._complete(request)
+        else:
+            self.pending.append(request)
+        return request
+
+    def tick(self):
+        self.ticks += 1
+        if not self.pending:
+            return
+
+        deadline = time.time() + self.budgetMillis / 1000.0
+        pending = self.pending
+        remaining = self.budgetMillis
+        while pending and remaining > 0:
+            request = pending.popleft()
+            if request.search.advance(self.sliceNodes, remaining):
+                self._complete(request)
+            else:
+                pending.append(request)
+            remaining = (deadline - time.time()) * 1000.0
+
+    def _complete(self, request):
+        request.latency = (time.time() - request.requestTime) * 1000.0
+        request.latencyTicks = self.ticks - request.requestTick
+
+        self.completed += 1
+        self.totalLatency += request.latency
+        self.maxLatency = max(self.maxLatency, request.latency)
+        self.maxLatencyTicks = max(self.maxLatencyTicks, request.latencyTicks)
+
+        if request.callback:
+            request.callback(request.path)
+
+    def meanLatency(self):
+        if not self.completed:
+            return 0.0
+        return self.totalLatency / self.completed
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __repr__(self):
+        return 'pending: %d, completed: %d, latency mean: %.2fms, max: %.2fms / %d ticks' % (
+            len(self.pending), self.completed, self.meanLatency(), self.maxLatency,
+            self.maxLatencyTicks)
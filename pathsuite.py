@@ -0,0 +1,320 @@
+"""
+Reproducible pathfinding benchmark. Runs every search mode over
+MovingAI grid maps and scenarios (the .map/.scen formats of
+movingai.com/benchmarks) and over seeded Perlin maps, and writes JSON
+for comparing one commit against another:
+
+    python pathsuite.py -o base.json
+    (change things)
+    python pathsuite.py -o new.json --compare base.json
+
+Besides the AStar modes there are 'grid' and 'jps' (GridAStar),
+'hpa' (HPAStar), 'dstarlite' (DStarLite, answering unrelated queries
+one after another) and 'alt' (exact A* with LandmarkHeuristic).
+
+Each map and mode reports the time spent building the planner, its
+query times, nodes expanded, the most nodes one query allocated, the
+peak resident memory above what the map itself takes, and path cost
+over the optimal cost. HPAStar only counts the nodes of its abstract
+graph. Optimal costs
+come from GridAStar, using this repo's costs: every step costs the
+tile entered, diagonals included, so they are not the octile lengths
+listed in .scen files.
+"""
+
+import json, os, random, resource, subprocess, sys, time, traceback
+from optparse import OptionParser
+
+from map import Map
+from astar import AStar, SearchStats
+from gridastar import GridAStar
+from hpastar import HPAStar
+from dstarlite import DStarLite
+from landmarks import LandmarkHeuristic
+from connectivity import ConnectivityIndex
+from maputils import getCost, isImpassable
+from pathbench import makePerlinMap, makeWeightedMap, chebyshev
+
+MODES = AStar.MODES + ('grid', 'jps', 'hpa', 'dstarlite', 'alt')
+
+# terrain characters a unit can stand on, the rest are walls, trees
+# and water
+MOVINGAI_PASSABLE = '.GS'
+
+def loadMovingAIMap(path):
+    f = open(path)
+    lines = f.read().splitlines()
+    f.close()
+
+    header = {}
+    for i, line in enumerate(lines):
+        if line.strip() == 'map':
+            break
+        key, value = line.split()
+        header[key] = value
+    width = int(header['width'])
+    height = int(header['height'])
+    rows = lines[i + 1:i + 1 + height]
+
+    def initMapElement(elem):
+        # chunks run past the map's edge
+        if elem.x < width and elem.y < height and rows[elem.y][elem.x] in MOVINGAI_PASSABLE:
+            t = 'normal'
+        else:
+            t = 'impassable'
+        elem.meta = {'image': t,
+                     'type': t,
+                     'cost': 1}
+
+    m = Map(mapElementCB = initMapElement, width = width, height = height)
+    m.meta['averageCost'] = 1
+    return m
+
+def loadScenarios(path):
+    """
+    Returns {map path: [((sx, sy), (gx, gy)), ...]} for a .scen file,
+    with map paths resolved next to the scenario file.
+    """
+    scenarios = {}
+    directory = os.path.dirname(path)
+    f = open(path)
+    for line in f:
+        fields = line.split()
+        if len(fields) < 9 or fields[0] == 'version':
+            continue
+        mapPath = os.path.join(directory, fields[1])
+        if not os.path.exists(mapPath):
+            mapPath = os.path.join(directory, os.path.basename(fields[1]))
+        sx, sy, gx, gy = [int(value) for value in fields[4:8]]
+        scenarios.setdefault(mapPath, []).append(((sx, sy), (gx, gy)))
+    f.close()
+    return scenarios
+
+def connectedQueries(grid, count, seed = 0):
+    # random pairs of tiles that have a path between them
+    rand = random.Random(seed)
+    index = ConnectivityIndex(grid.width, grid.height, grid.passable, grid.diagonal)
+    tiles = [i for i in range(grid.width * grid.height) if grid.passable[i]]
+    queries = []
+    while tiles and len(queries) < count:
+        a = rand.choice(tiles)
+        b = rand.choice(tiles)
+        if index.connected(a, b):
+            queries.append(((a % grid.width, a // grid.width), (b % grid.width, b // grid.width)))
+    return queries
+
+def perlinCases(sizes, count, seed):
+    cases = []
+    for size in sizes:
+        for kind, makeMap in (('uniform', lambda: makePerlinMap(size, 0.3, seed, threshold = 0.35)),
+                              ('weighted', lambda: makeWeightedMap(size, seed))):
+            m = makeMap()
+            grid = GridAStar.fromMap(m)
+            cases.append(('perlin-%s-%d' % (kind, size), m, grid, connectedQueries(grid, count, seed)))
+    return cases
+
+def scenarioCases(paths, count):
+    cases = []
+    for path in paths:
+        for mapPath, queries in sorted(loadScenarios(path).items()):
+            m = loadMovingAIMap(mapPath)
+            cases.append((os.path.basename(mapPath), m, GridAStar.fromMap(m), queries[:count]))
+    return cases
+
+def currentRSS():
+    # resident set in kilobytes, where /proc has it
+    try:
+        f = open('/proc/self/statm')
+        pages = int(f.read().split()[1])
+        f.close()
+    except (IOError, OSError):
+        return 0
+    return pages * resource.getpagesize() // 1024
+
+def isolated(func, label):
+    """
+    Runs func in a forked child so that the peak memory it reports is
+    its own, and returns func's dict with peakKB added. A failure in
+    the child is raised here, naming label.
+    """
+    if not hasattr(os, 'fork'):
+        result = func()
+        result['peakKB'] = None
+        return result
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        try:
+            base = currentRSS()
+            result = func()
+            # ru_maxrss is in kilobytes on Linux
+            result['peakKB'] = max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base)
+            os.write(write, json.dumps(result))
+        except:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    os.close(write)
+    chunks = []
+    while True:
+        chunk = os.read(read, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read)
+    status = os.waitpid(pid, 0)[1]
+    if status != 0:
+        raise RuntimeError('%s failed in its child process (wait status %d), see the '
+                           'traceback above' % (label, status))
+    return json.loads(''.join(chunks))
+
+def runMode(m, grid, queries, mode, epsilon, anytimeMillis, anytimeNodes):
+    stats = SearchStats()
+    start = time.time()
+    if mode in ('grid', 'jps', 'hpa'):
+        w = grid.width
+        if mode == 'hpa':
+            planner = HPAStar(grid)
+            find = lambda a, b: planner.best_path_ids(a, b, stats)
+        else:
+            find = lambda a, b: grid.best_path_ids(a, b, stats, 'jps' if mode == 'jps' else 'astar')
+        search = lambda posA, posB: grid.pathCost(find(posA[1] * w + posA[0], posB[1] * w + posB[0]))
+    else:
+        minCost = grid.minCost()
+        costFunc = lambda elem: getCost(m, elem)
+        heuristic = lambda elem1, elem2: chebyshev(elem1, elem2) * minCost
+        if mode == 'dstarlite':
+            planner = DStarLite(m.getDiagonalAdjacencies, costFunc, heuristic, isImpassable)
+            find = lambda elemA, elemB: planner.best_path(elemA, elemB, stats)
+        else:
+            searchMode = mode
+            if mode == 'alt':
+                heuristic = LandmarkHeuristic.build(grid).heuristic
+                searchMode = 'astar'
+            astar = AStar(m.getDiagonalAdjacencies, costFunc, heuristic, isImpassable,
+                          epsilon = epsilon)
+            find = lambda elemA, elemB: astar.best_path(elemA, elemB, stats, searchMode,
+                                                        anytimeMillis, anytimeNodes)
+        def search(posA, posB):
+            path = find(m.getMapElement(*posA), m.getMapElement(*posB))
+            return sum([getCost(m, elem) for elem in path])
+    buildMs = (time.time() - start) * 1000
+
+    times = []
+    costs = []
+    expanded = 0
+    peakNodes = 0
+    for posA, posB in queries:
+        start = time.time()
+        cost = search(posA, posB)
+        times.append((time.time() - start) * 1000)
+        costs.append(cost)
+        expanded += stats.nodesExpanded
+        peakNodes = max(peakNodes, stats.nodesAllocated)
+    return {'buildMs': buildMs, 'times': times, 'costs': costs, 'nodesExpanded': expanded,
+            'peakNodes': peakNodes}
+
+def runCase(name, m, grid, queries, modes, epsilon, anytimeMillis, anytimeNodes):
+    w = grid.width
+    optimal = [grid.pathCost(grid.best_path_ids(posA[1] * w + posA[0], posB[1] * w + posB[0]))
+               for posA, posB in queries]
+
+    results = []
+    for mode in modes:
+        run = isolated(lambda: runMode(m, grid, queries, mode, epsilon, anytimeMillis, anytimeNodes),
+                       '%s on %s' % (mode, name))
+        times = run['times']
+        ratios = [float(cost) / best for cost, best in zip(run['costs'], optimal) if cost and best]
+        results.append({'map': name,
+                        'mode': mode,
+                        'queries': len(queries),
+                        'solved': len([cost for cost in run['costs'] if cost]),
+                        'buildMs': run['buildMs'],
+                        'totalMs': sum(times),
+                        'meanMs': sum(times) / max(1, len(times)),
+                        'maxMs': max(times or [0]),
+                        'nodesExpanded': run['nodesExpanded'],
+                        'peakNodes': run['peakNodes'],
+                        'peakKB': run['peakKB'],
+                        'optimality': sum(ratios) / len(ratios) if ratios else None,
+                        'worstOptimality': max(ratios) if ratios else None})
+    return results
+
+def currentCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd = os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(base, report, out = sys.stderr):
+    # mean time and nodes expanded relative to an earlier report
+    old = dict(((result['map'], result['mode']), result) for result in base['results'])
+    print >> out, '%-24s %14s %10s %10s %12s %10s' % ('map', 'mode', 'ms', 'change', 'expanded',
+                                                      'change')
+    for result in report['results']:
+        before = old.get((result['map'], result['mode']))
+        if before is None:
+            continue
+        timeChange = result['meanMs'] / before['meanMs'] - 1 if before['meanMs'] else 0
+        nodeChange = (float(result['nodesExpanded']) / before['nodesExpanded'] - 1
+                      if before['nodesExpanded'] else 0)
+        print >> out, '%-24s %14s %10.3f %+9.1f%% %12d %+9.1f%%' % (
+            result['map'], result['mode'], result['meanMs'], timeChange * 100,
+            result['nodesExpanded'], nodeChange * 100)
+
+def main(argv):
+    parser = OptionParser(usage = '%prog [options] [file.scen ...]')
+    parser.add_option('-o', '--output', help = 'write the JSON report here instead of stdout')
+    parser.add_option('--compare', metavar = 'REPORT', help = 'print changes against an earlier report')
+    parser.add_option('--sizes', default = '64,128', help = 'Perlin map sizes, none to skip them')
+    parser.add_option('--queries', type = 'int', default = 30, help = 'queries per map')
+    parser.add_option('--seed', type = 'int', default = 0)
+    parser.add_option('--modes', default = ','.join(MODES))
+    parser.add_option('--epsilon', type = 'float', default = 1.5)
+    parser.add_option('--anytime-nodes', dest = 'anytimeNodes', type = 'int', default = 2000,
+                      help = 'nodes the anytime mode may expand per query, 0 for no limit')
+    parser.add_option('--anytime-ms', dest = 'anytimeMillis', type = 'float',
+                      help = 'time the anytime mode may take per query; depends on the machine')
+    options, scenarioPaths = parser.parse_args(argv)
+
+    modes = options.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('unknown mode %s' % mode)
+    anytimeNodes = options.anytimeNodes or None
+    sizes = [int(size) for size in options.sizes.split(',')] if options.sizes != 'none' else []
+
+    cases = perlinCases(sizes, options.queries, options.seed) + scenarioCases(scenarioPaths, options.queries)
+    results = []
+    for name, m, grid, queries in cases:
+        print >> sys.stderr, '%s (%d queries)' % (name, len(queries))
+        results.extend(runCase(name, m, grid, queries, modes, options.epsilon, options.anytimeMillis,
+                               anytimeNodes))
+
+    report = {'commit': currentCommit(),
+              'python': sys.version.split()[0],
+              'seed': options.seed,
+              'epsilon': options.epsilon,
+              'anytimeMs': options.anytimeMillis,
+              'anytimeNodes': anytimeNodes,
+              'results': results}
+    text = json.dumps(report, indent = 1, sort_keys = True)
+    if options.output:
+        f = open(options.output, 'w')
+        f.write(text + '\n')
+        f.close()
+    else:
+        print text
+
+    if options.compare:
+        f = open(options.compare)
+        base = json.load(f)
+        f.close()
+        compare(base, report)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
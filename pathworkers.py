@@ -0,0 +1,197 @@
+import pickle, threading
+from multiprocessing import Process, Queue
+from Queue import Empty
+from multiprocessing.sharedctypes import RawArray
+
+from gridastar import GridAStar
+from maputils import getCost, isImpassableAt
+
+# how often the collector looks for workers that died, in seconds
+REAP_INTERVAL = 0.5
+
+class PathFuture (object):
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _set(self, result):
+        self._result = result
+        self._event.set()
+
+    def _fail(self, error):
+        self._error = error
+        self._event.set()
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout = None):
+        if not self._event.wait(timeout):
+            raise RuntimeError('path request timed out')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+def _worker(width, height, diagonal, costs, passable, inbox, results):
+    grid = GridAStar(width, height, costs, passable, diagonal)
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        if message[0] == 'edit':
+            # the shared arrays already hold the edit
+            grid.invalidate()
+        else:
+            requestId, start, goal, mode = message[1:]
+            try:
+                results.put((requestId, grid.best_path_ids(start, goal, mode = mode), None))
+            except Exception, e:
+                # a bad request fails alone and the worker carries on
+                try:
+                    pickle.dumps(e)
+                except Exception:
+                    e = RuntimeError('%s: %s' % (type(e).__name__, e))
+                results.put((requestId, None, e))
+
+class PathWorkerPool (object):
+    """
+    Runs GridAStar queries in worker processes. The cost and
+    passability arrays live in shared memory, so the map is never
+    pickled per request. Edits are written there and also sent to every
+    worker as deltas, in order with its requests, so each worker drops
+    its cached cost range and jump bitmap before its next query.
+    Searches already running when an edit lands may still see it.
+
+    A request that raises fails its own future with the exception. A
+    worker that dies fails every request still waiting on it and gets
+    no new ones. Each worker answers on its own queue, so one killed
+    while holding its queue's lock cannot stall the others.
+    """
+
+    def __init__(self, grid, numWorkers = 2):
+        self.width = grid.width
+        self.height = grid.height
+        self.costs = RawArray('d', list(grid.costs))
+        self.passable = RawArray('B', [1 if p else 0 for p in grid.passable])
+
+        self._inboxes = []
+        self._results = []
+        self._workers = []
+        self._outstanding = []
+        for i in range(numWorkers):
+            inbox = Queue()
+            results = Queue()
+            worker = Process(target = _worker,
+                             args = (grid.width, grid.height, grid.diagonal,
+                                     self.costs, self.passable, inbox, results))
+            worker.daemon = True
+            worker.start()
+            self._inboxes.append(inbox)
+            self._results.append(results)
+            self._workers.append(worker)
+            self._outstanding.append(0)
+        self._dead = set()
+
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._nextId = 0
+        self._closed = threading.Event()
+        self._collectors = []
+        for results in self._results:
+            collector = threading.Thread(target = self._collect, args = (results,))
+            collector.daemon = True
+            collector.start()
+            self._collectors.append(collector)
+
+    @classmethod
+    def fromMap(cls, map, numWorkers = 2):
+        pool = cls(GridAStar.fromMap(map), numWorkers)
+        map.addChangeListener(lambda x, y: pool.applyEdits(
+            [(x, y, getCost(map, map.getMapElement(x, y)), not isImpassableAt(map, x, y))]))
+        return pool
+
+    def submit(self, posA, posB, mode = 'astar'):
+        w = self.width
+        future = PathFuture()
+        self._reapDead()
+        with self._lock:
+            alive = [i for i in range(len(self._workers)) if i not in self._dead]
+            if not alive:
+                raise RuntimeError('every path worker has died')
+            requestId = self._nextId
+            self._nextId += 1
+            # least busy worker first
+            worker = min(alive, key = lambda i: self._outstanding[i])
+            self._outstanding[worker] += 1
+            self._futures[requestId] = (future, worker)
+        self._inboxes[worker].put(('path', requestId, posA[1] * w + posA[0],
+                                   posB[1] * w + posB[0], mode))
+        return future
+
+    def best_path(self, posA, posB, mode = 'astar'):
+        return self.submit(posA, posB, mode).result()
+
+    def applyEdits(self, edits):
+        """
+        edits is a list of (x, y, cost, passable) tuples.
+        """
+        w = self.width
+        for x, y, cost, isPassable in edits:
+            self.costs[y * w + x] = cost
+            self.passable[y * w + x] = 1 if isPassable else 0
+        for inbox in self._inboxes:
+            inbox.put(('edit', edits))
+
+    def _reapDead(self):
+        # fail whatever was waiting on a worker that is gone
+        failed = []
+        with self._lock:
+            for i, worker in enumerate(self._workers):
+                if i in self._dead or worker.is_alive():
+                    continue
+                self._dead.add(i)
+                for requestId, (future, owner) in self._futures.items():
+                    if owner == i:
+                        del self._futures[requestId]
+                        failed.append((future, i, worker.exitcode))
+                self._outstanding[i] = 0
+        for future, i, exitcode in failed:
+            future._fail(RuntimeError('path worker %d died with exit code %s' % (i, exitcode)))
+
+    def _collect(self, results):
+        w = self.width
+        while True:
+            try:
+                message = results.get(timeout = REAP_INTERVAL)
+            except Empty:
+                if self._closed.is_set():
+                    break
+                self._reapDead()
+                continue
+            requestId, ids, error = message
+            with self._lock:
+                entry = self._futures.pop(requestId, None)
+                if entry is not None:
+                    self._outstanding[entry[1]] -= 1
+            if entry is None:
+                continue
+            if error is not None:
+                entry[0]._fail(error)
+            else:
+                entry[0]._set([(i % w, i // w) for i in ids])
+
+    def close(self):
+        for inbox, worker in zip(self._inboxes, self._workers):
+            if worker.is_alive():
+                inbox.put(None)
+            else:
+                # nobody will read it, do not wait on it at exit
+                inbox.cancel_join_thread()
+        for worker in self._workers:
+            worker.join()
+        # the collectors notice within REAP_INTERVAL; a queue whose
+        # worker was killed mid-write could not take a sentinel
+        self._closed.set()
+        for collector in self._collectors:
+            collector.join()
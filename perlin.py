@@ -1,3 +1,8 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Perlin (object):
     def __init__(self, seed=0):
         self.seed = seed
@@ -53,6 +58,50 @@ class Perlin (object):
 
         return fin/div
 
+    def _noise2Block(self, hash, x, y):
+        tmp = hash[(y + self.seed).astype(int) % 256]
+        return hash[(tmp + x).astype(int) % 256]
+
+    def _noise2dBlock(self, hash, x, y):
+        x_int = x
+        y_int = y
+        x_frac = x - x_int
+        y_frac = y - y_int
+        s = self._noise2Block(hash, x_int, y_int)
+        t = self._noise2Block(hash, x_int+1, y_int)
+        u = self._noise2Block(hash, x_int, y_int+1)
+        v = self._noise2Block(hash, x_int+1, y_int+1)
+        low = self._smooth_inter(s, t, x_frac)
+        high = self._smooth_inter(u, v, x_frac)
+        return self._smooth_inter(low, high, y_frac)
+
+    def perlin2dBlock(self, x0, y0, width, height, freq, depth):
+        """
+        Noise for the width x height block of tiles starting at (x0,
+        y0), indexed [y][x], equal to calling perlin2d on every tile.
+        All tiles and octaves are computed in whole-array NumPy
+        operations; without NumPy it falls back to perlin2d per tile.
+        """
+        if numpy is None:
+            return [[self.perlin2d(x, y, freq, depth) for x in range(x0, x0 + width)]
+                    for y in range(y0, y0 + height)]
+
+        hash = numpy.array(self.hash)
+        xa, ya = numpy.meshgrid(numpy.arange(x0, x0 + width) * freq,
+                                numpy.arange(y0, y0 + height) * freq)
+        amp = 1.0
+        fin = numpy.zeros((height, width))
+        div = 0.0
+
+        for i in range(depth):
+            div += 256 * amp
+            fin += self._noise2dBlock(hash, xa, ya) * amp
+            amp /= 2
+            xa *= 2
+            ya *= 2
+
+        return fin/div
+
 
 if __name__ == '__main__':
     per = Perlin()
@@ -1,3 +1,8 @@
+from heapq import heappush, heappop
+from itertools import count
+
+INFINITY = float('inf')
+
 class PriorityQueueSet ():
     """
     Basic implementation of a priority queue set using dicts. The
@@ -6,8 +11,12 @@ class PriorityQueueSet ():
 
     def __init__(self, *args):
         self.queue = {}
-        
+
     def add(self, x, priority=0):
+        # drop the old key first so that the stored key is replaced
+        # along with the priority
+        if x in self.queue:
+            del self.queue[x]
         self.queue[x] = priority
 
     def get(self, x):
@@ -33,3 +42,149 @@ class PriorityQueueSet ():
 
     def __repr__(self):
         return self.queue.__str__()
+
+class HeapPriorityQueueSet (object):
+    """
+    Binary heap implementation of a priority queue set. An index from
+    item to heap position is kept alongside the heap so that
+    membership is O(1) and both popping and re-adding an item with a
+    new priority (decrease-key) are O(log n).
+    """
+
+    def __init__(self, *args):
+        self.heap = []
+        self.index = {}
+
+    def add(self, x, priority=0):
+        if x in self.index:
+            pos = self.index[x]
+            entry = self.heap[pos]
+            oldPriority = entry[0]
+            # swap in the new key as well, it may carry a new parent
+            del self.index[entry[1]]
+            entry[0] = priority
+            entry[1] = x
+            self.index[x] = pos
+            if priority < oldPriority:
+                self._siftUp(pos)
+            elif oldPriority < priority:
+                self._siftDown(pos)
+        else:
+            self.heap.append([priority, x])
+            pos = len(self.heap) - 1
+            self.index[x] = pos
+            self._siftUp(pos)
+
+    def get(self, x):
+        return self.heap[self.index[x]][0]
+
+    def pop(self):
+        heap = self.heap
+        if not heap:
+            return None
+
+        last = heap.pop()
+        if heap:
+            top = heap[0]
+            heap[0] = last
+            self.index[last[1]] = 0
+            self._siftDown(0)
+        else:
+            top = last
+        del self.index[top[1]]
+        return top[1]
+
+    def _siftUp(self, pos):
+        heap = self.heap
+        index = self.index
+        entry = heap[pos]
+        while pos > 0:
+            parentPos = (pos - 1) >> 1
+            parent = heap[parentPos]
+            if not entry[0] < parent[0]:
+                break
+            heap[pos] = parent
+            index[parent[1]] = pos
+            pos = parentPos
+        heap[pos] = entry
+        index[entry[1]] = pos
+
+    def _siftDown(self, pos):
+        heap = self.heap
+        index = self.index
+        size = len(heap)
+        entry = heap[pos]
+        child = 2 * pos + 1
+        while child < size:
+            right = child + 1
+            if right < size and heap[right][0] < heap[child][0]:
+                child = right
+            if not heap[child][0] < entry[0]:
+                break
+            heap[pos] = heap[child]
+            index[heap[pos][1]] = pos
+            pos = child
+            child = 2 * pos + 1
+        heap[pos] = entry
+        index[entry[1]] = pos
+
+    def __contains__(self, x):
+        return self.index.__contains__(x)
+
+    def __len__(self):
+        return self.heap.__len__()
+
+    def __repr__(self):
+        return dict((x, p) for (p, x) in self.heap).__str__()
+
+class LazyHeap (object):
+    """
+    Binary heap where re-adding an item with a new key leaves its old
+    entry behind, to be skipped once it reaches the top, instead of
+    moving it. keys holds each queued item's current key; entries
+    are (key, tiebreak, item) so that items never get compared.
+
+    Keys are (f, g) pairs, and topKey gives (INFINITY, INFINITY) once
+    the heap is empty.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.keys = {}
+        self._counter = count()
+
+    def add(self, x, key):
+        self.keys[x] = key
+        heappush(self.heap, (key, next(self._counter), x))
+
+    def remove(self, x):
+        self.keys.pop(x, None)
+
+    def topKey(self):
+        heap = self.heap
+        keys = self.keys
+        while heap:
+            key, tiebreak, x = heap[0]
+            if keys.get(x) == key:
+                return key
+            heappop(heap)
+        return (INFINITY, INFINITY)
+
+    def pop(self):
+        self.topKey()
+        x = heappop(self.heap)[2]
+        del self.keys[x]
+        return x
+
+    def clear(self):
+        del self.heap[:]
+        self.keys.clear()
+
+    def __contains__(self, x):
+        return self.keys.__contains__(x)
+
+    def __len__(self):
+        return self.keys.__len__()
+
+    def __iter__(self):
+        return self.keys.__iter__()
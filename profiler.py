@@ -0,0 +1,117 @@
+import json, math, time, threading
+from collections import deque
+
+class _NullScope (object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_nullScope = _NullScope()
+
+class _Scope (object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, self.start, time.time() - self.start)
+        return False
+
+class Profiler (object):
+    """
+    Named timing scopes:
+
+        with profiler.scope('mobs'):
+            ...
+
+    While enabled, each scope keeps its last window durations for
+    percentiles and a running total, and with tracing on every scope is
+    also logged as a Chrome trace event (chrome://tracing, Perfetto).
+    While disabled, scope hands back one shared do-nothing object, so
+    instrumented code pays a method call and nothing else. Scopes may
+    be recorded from any thread.
+    """
+
+    def __init__(self, window = 120, maxTraceEvents = 1000000):
+        self.enabled = False
+        self.tracing = False
+        self.window = window
+        self.maxTraceEvents = maxTraceEvents
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.samples = {}
+        self.totals = {}
+        self.counts = {}
+        self.traceEvents = []
+        self._epoch = time.time()
+
+    def enable(self, tracing = False):
+        self.enabled = True
+        self.tracing = tracing
+
+    def disable(self):
+        self.enabled = False
+        self.tracing = False
+
+    def scope(self, name):
+        if not self.enabled:
+            return _nullScope
+        return _Scope(self, name)
+
+    def record(self, name, start, duration):
+        with self._lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen = self.window)
+                self.totals[name] = 0.0
+                self.counts[name] = 0
+            samples.append(duration)
+            self.totals[name] += duration
+            self.counts[name] += 1
+
+            if self.tracing and len(self.traceEvents) < self.maxTraceEvents:
+                self.traceEvents.append({'name': name, 'ph': 'X', 'pid': 0,
+                                         'tid': threading.current_thread().ident,
+                                         'ts': (start - self._epoch) * 1e6,
+                                         'dur': duration * 1e6})
+
+    def names(self):
+        return sorted(self.samples.keys())
+
+    def total(self, name):
+        return self.totals.get(name, 0.0)
+
+    def percentile(self, name, p):
+        """
+        The p-th percentile, nearest rank, of the recent durations of
+        scope name in seconds.
+        """
+        with self._lock:
+            samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return 0.0
+        rank = int(math.ceil(p / 100.0 * len(samples))) - 1
+        return samples[max(0, rank)]
+
+    def summary(self, percentiles = (50, 95, 99)):
+        return [(name, [self.percentile(name, p) for p in percentiles]) for name in self.names()]
+
+    def dumpTrace(self, path):
+        f = open(path, 'w')
+        json.dump({'traceEvents': self.traceEvents, 'displayTimeUnit': 'ms'}, f)
+        f.close()
+
+# the one the game and its subsystems report to
+profiler = Profiler()
@@ -0,0 +1,128 @@
+import sys, time, random
+
+import pygame
+
+from map import CameraGroup
+from imagecache import ImageCache
+from main import GameLoop, MobSprite
+from mobswarm import MobSwarm
+
+def benchRender(frames = 300, modes = GameLoop.RENDER_MODES):
+    game = GameLoop(10, 5, headless = True)
+    game.initLevel()
+    game.prefetcher.stop()
+
+    scenarios = [('static', (0, 0)), ('scroll', (15, 15))]
+
+    print '%8s %8s %14s %18s' % ('mode', 'view', 'render fps', 'update+render fps')
+    for mode in modes:
+        for name, (dx, dy) in scenarios:
+            random.seed(0)
+            game.renderMode = mode
+            game._lastRenderOffset = None
+            game.mobs.empty()
+            game.playerSprite.dx, game.playerSprite.dy = dx, dy
+
+            renderTime = 0.0
+            start = time.time()
+            for i in range(frames):
+                game.update()
+                renderStart = time.time()
+                game.render()
+                renderTime += time.time() - renderStart
+            total = time.time() - start
+            print '%8s %8s %14.1f %18.1f' % (mode, name, frames / renderTime, frames / total)
+
+    game.playerSprite.dx, game.playerSprite.dy = 0, 0
+
+def benchMobs(counts = (100, 1000, 10000), ticks = 30, maxSpriteMobs = 1000):
+    game = GameLoop(10, 5, headless = True)
+    game.initLevel()
+    game.prefetcher.stop()
+    player = game.playerSprite
+    image = game.imageCache.getCachedSurface("mob")
+
+    def spawn(group, count):
+        # spread over a few screens around the view
+        for i in range(count):
+            x = random.randint(-800, 1600)
+            y = random.randint(-600, 1200)
+            speed = random.random() * 12.5 + 12.5
+            if isinstance(group, MobSwarm):
+                group.spawn(x, y, speed)
+            else:
+                group.add(MobSprite(x, y, image, speed, player, game.mapView, player.collider))
+
+    print '%8s %8s %14s %14s' % ('backend', 'mobs', 'update (ms)', 'draw (ms)')
+    for backend in GameLoop.MOB_BACKENDS:
+        for count in counts:
+            if backend == 'sprites' and count > maxSpriteMobs:
+                continue
+            random.seed(0)
+            if backend == 'arrays':
+                group = MobSwarm(game.levelMap, game.mapView, image, 32, 32)
+            else:
+                group = CameraGroup(game.mapView)
+            spawn(group, count)
+
+            updateTime = drawTime = 0.0
+            for i in range(ticks):
+                start = time.time()
+                group.update()
+                updateTime += time.time() - start
+                start = time.time()
+                group.draw(game.screen)
+                drawTime += time.time() - start
+            print '%8s %8d %14.2f %14.2f' % (backend, count, updateTime / ticks * 1000, drawTime / ticks * 1000)
+
+def benchScroll(counts = (0, 100, 1000, 5000), scrolls = 300):
+    # the view scrolling on its own, without drawing; mobs live in world
+    # space so the cost should not grow with their number
+    game = GameLoop(10, 5, headless = True)
+    game.initLevel()
+    game.prefetcher.stop()
+    player = game.playerSprite
+    image = game.imageCache.getCachedSurface("mob")
+
+    print '%8s %14s' % ('mobs', 'scroll (us)')
+    for count in counts:
+        random.seed(0)
+        game.mobs.empty()
+        for i in range(count):
+            game.mobs.add(MobSprite(random.randint(0, 800), random.randint(0, 600), image,
+                                    12.5, player, game.mapView, player.collider))
+
+        start = time.time()
+        for i in range(scrolls):
+            game.mapView.moveViewByPixels(1 if i % 64 < 32 else -1, 0)
+        print '%8d %14.1f' % (count, (time.time() - start) / scrolls * 1e6)
+
+def benchImages(blits = 20000, directories = ('terrains', 'units')):
+    game = GameLoop(10, 5, headless = True)
+    screen = game.screen
+
+    raw = [pygame.image.load(path) for path in ImageCache().preload(directories)]
+    converted = ImageCache()
+    converted.preload(directories)
+    atlas = ImageCache()
+    atlas.preload(directories)
+    atlas.buildAtlas()
+
+    print '%10s %14s' % ('images', 'us/blit')
+    for name, images in (('raw', raw), ('converted', converted.cache.values()),
+                         ('atlas', atlas.cache.values())):
+        start = time.time()
+        for i in range(blits):
+            screen.blit(images[i % len(images)], (i * 13 % 768, i * 7 % 568))
+        print '%10s %14.2f' % (name, (time.time() - start) / blits * 1e6)
+
+benchmarks = {'render': benchRender,
+              'images': benchImages,
+              'mobs': benchMobs,
+              'scroll': benchScroll}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(benchmarks.keys())
+    for name in names:
+        print '== %s ==' % name
+        benchmarks[name]()
@@ -0,0 +1,25 @@
+import sys
+
+from perlin import Perlin
+from pathbench import timeIt
+
+def benchPerlin(sizes = (32, 128, 512), freq = 40, depth = 4):
+    per = Perlin()
+
+    def scalar(size):
+        return [[per.perlin2d(x, y, freq, depth) for x in range(size)] for y in range(size)]
+
+    print '%6s %16s %16s' % ('block', 'scalar tiles/s', 'block tiles/s')
+    for size in sizes:
+        scalarTime, result = timeIt(lambda: scalar(size), 1)
+        blockTime, result = timeIt(lambda: per.perlin2dBlock(0, 0, size, size, freq, depth))
+        tiles = size * size
+        print '%6d %16.0f %16.0f' % (size, tiles / scalarTime, tiles / blockTime)
+
+benchmarks = {'perlin': benchPerlin}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(benchmarks.keys())
+    for name in names:
+        print '== %s ==' % name
+        benchmarks[name]()
@@ -0,0 +1,37 @@
+import sys, zlib
+
+import pygame
+
+from main import GameLoop
+
+def walkScript(ticks, hold = 40, keys = (pygame.K_d, pygame.K_s, pygame.K_a, pygame.K_w)):
+    """
+    Holds each of keys for hold ticks in turn, the same walk every run.
+    """
+    script = {}
+    for i, start in enumerate(range(0, ticks, hold)):
+        key = keys[i % len(keys)]
+        script.setdefault(start, []).append(pygame.event.Event(pygame.KEYDOWN, key = key))
+        script.setdefault(start + hold - 1, []).append(pygame.event.Event(pygame.KEYUP, key = key))
+    return script
+
+def benchTicks(ticks = 300, seed = 0, backends = (('sprites', 20), ('arrays', 2000))):
+    print '%8s %6s' % ('backend', 'mobs') + ''.join(['%11s' % name for name in GameLoop.SUBSYSTEMS]) + '%11s' % 'state'
+    for backend, maxMobs in backends:
+        game = GameLoop(10, 5, mob_backend = backend, max_mobs = maxMobs, headless = True, seed = seed)
+        timings = game.simulate(ticks, walkScript(ticks))
+        game.prefetcher.stop()
+
+        # same seed and script, same final frame
+        state = zlib.crc32(pygame.image.tostring(game.screen, 'RGB')) & 0xffffffff
+        print '%8s %6d' % (backend, len(game.mobs)) + \
+              ''.join(['%9.3fms' % (timings[name] / ticks * 1000) for name in GameLoop.SUBSYSTEMS]) + \
+              '%11x' % state
+
+benchmarks = {'ticks': benchTicks}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(benchmarks.keys())
+    for name in names:
+        print '== %s ==' % name
+        benchmarks[name]()